@@ -9,4 +9,8 @@ from . import task_runner
 from . import task_tree
 from . import task
 from . import workspace
-from . import hdfzip 
\ No newline at end of file
+from . import hdfzip
+from . import task_cache
+from . import stream
+from . import codec
+from . import compression
\ No newline at end of file
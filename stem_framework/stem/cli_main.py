@@ -4,7 +4,9 @@ import json
 from pathlib import Path
 import sys
 
+from stem.task_cache import DiskCache
 from stem.task_master import TaskMaster, TaskStatus
+from stem.task_runner import SimpleRunner
 
 from stem.workspace import IWorkspace, TaskPath
 
@@ -29,6 +31,10 @@ def create_parser() -> argparse.ArgumentParser:
         '-m', '--meta',
         help = 'Metadata for task or path to file with metadata in JSON format'
     )
+    subparser_run.add_argument(
+        '-c', '--cache-dir',
+        help = 'Directory where results of tasks are stored and reused between runs'
+    )
 
     parser.add_argument(
         '-w', '--workspace',
@@ -82,7 +88,12 @@ def execute_task_master_execute(args: argparse.Namespace):
             with open(args.meta) as metafile:
                 meta = json.load(metafile)
 
-    pre_res = TaskMaster().execute(meta, task, workspace)
+    if args.cache_dir is None:
+        task_master = TaskMaster()
+    else:
+        task_master = TaskMaster(SimpleRunner(DiskCache(args.cache_dir)))
+
+    pre_res = task_master.execute(meta, task, workspace)
     if pre_res.status == TaskStatus.CONTAINS_DATA:
         print(pre_res.lazy_data())
     else:
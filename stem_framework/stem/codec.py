@@ -0,0 +1,151 @@
+"""Codecs turn values into the data section of an envelope and back.
+
+The name of the codec and its parameters (e.g. dtype and shape of an array) are put into the metadata
+of the envelope, so the data section holds only raw bytes, and the receiver decodes it without copying
+where it is possible: `np.frombuffer` for arrays, out-of-band buffers for pickle.
+"""
+
+import json
+import pickle
+from abc import ABC, abstractmethod
+from typing import Any, Sequence
+
+import numpy as np
+
+from . import compression
+from .envelope import Binary, Envelope, MetaEncoder
+from .meta import Meta, get_meta_attr
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class CodecError(ValueError):
+    pass
+
+
+class Codec(ABC):
+    name: str
+
+    @abstractmethod
+    def encode(self, value: Any) -> tuple[Meta, Binary | list[Binary]]:
+        """Returns the parameters of the codec for the metadata and the data section.
+        The data section may be a list of buffers, they are written one after another.
+        Raises TypeError or ValueError if the codec can't encode the value."""
+
+    @abstractmethod
+    def decode(self, meta: Meta, data: Binary) -> Any:
+        pass
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def encode(self, value: Any) -> tuple[Meta, Binary]:
+        return {}, json.dumps(value, cls=MetaEncoder).encode('utf8')
+
+    def decode(self, meta: Meta, data: Binary) -> Any:
+        return json.loads(bytes(data))
+
+
+class NdarrayCodec(Codec):
+    """Raw bytes of the array, dtype and shape are in the metadata"""
+    name = 'ndarray'
+
+    def encode(self, value: Any) -> tuple[Meta, Binary]:
+        if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+            raise TypeError(f'{type(value)} is not an array of numbers')
+        value = np.ascontiguousarray(value)
+        return {'dtype': value.dtype.str, 'shape': list(value.shape)}, memoryview(value).cast('B')
+
+    def decode(self, meta: Meta, data: Binary) -> Any:
+        return np.frombuffer(data, get_meta_attr(meta, 'dtype')).reshape(get_meta_attr(meta, 'shape'))
+
+
+class PickleCodec(Codec):
+    """Pickle protocol 5: large buffers (e.g. of NumPy arrays) are written out-of-band after the pickle
+    and are not copied neither on encoding nor on decoding"""
+    name = 'pickle'
+
+    def encode(self, value: Any) -> tuple[Meta, list[Binary]]:
+        buffers: list[pickle.PickleBuffer] = []
+        pickled = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        raw = [b.raw() for b in buffers]
+        return {'buffers': [len(pickled)] + [r.nbytes for r in raw]}, [pickled, *raw]
+
+    def decode(self, meta: Meta, data: Binary) -> Any:
+        view = memoryview(data).cast('B')
+        parts = []
+        start = 0
+        for length in get_meta_attr(meta, 'buffers', [len(view)]):
+            parts.append(view[start : start + length])
+            start += length
+        return pickle.loads(parts[0], buffers=parts[1:])
+
+
+class MsgpackCodec(Codec):
+    """Needs the `msgpack` package"""
+    name = 'msgpack'
+
+    def encode(self, value: Any) -> tuple[Meta, Binary]:
+        return {}, msgpack.packb(value)
+
+    def decode(self, meta: Meta, data: Binary) -> Any:
+        return msgpack.unpackb(data)
+
+
+codecs: dict[str, Codec] = {}
+
+
+def register(codec: Codec) -> Codec:
+    codecs[codec.name] = codec
+    return codec
+
+
+register(JsonCodec())
+register(NdarrayCodec())
+register(PickleCodec())
+if msgpack is not None:
+    register(MsgpackCodec())
+
+
+DEFAULT_CODECS = ('ndarray', 'json', 'pickle')
+
+
+def encode(value: Any, meta: Meta | None = None, prefer: str | Sequence[str] = DEFAULT_CODECS) -> Envelope:
+    """Puts the value into an envelope with the first of the preferred codecs, which can encode it.
+    The name of the codec is `codec` field of the metadata, the parameters of the codec are `codec_meta`."""
+    names = [prefer] if isinstance(prefer, str) else prefer
+    errors = []
+    for name in names:
+        codec = codecs.get(name)
+        if codec is None:
+            errors.append(f'{name}: not registered')
+            continue
+        try:
+            codec_meta, data = codec.encode(value)
+        except (TypeError, ValueError, AttributeError, pickle.PicklingError) as e:
+            errors.append(f'{name}: {e}')
+            continue
+        meta = dict(meta or {}, codec=name, codec_meta=codec_meta)
+        if isinstance(data, list):
+            # the list, unlike an iterator, can be written several times
+            return Envelope(meta, data, data_length=sum(memoryview(d).nbytes for d in data))
+        return Envelope(meta, data)
+    raise CodecError(f'no codec can encode {type(value)}: ' + '; '.join(errors))
+
+
+def decode(envelope: Envelope) -> Any:
+    """The value of the envelope. An envelope without `codec` is JSON, as it was before codecs.
+    Compressed data is decompressed first."""
+    envelope = compression.decompress(envelope)
+    name = get_meta_attr(envelope.meta, 'codec', 'json')
+    codec = codecs.get(name)
+    if codec is None:
+        raise CodecError(f'codec {name} is not registered')
+    data = envelope.data
+    if not isinstance(data, Binary):
+        data = b''.join(data)  # type: ignore  # a streamed data section
+    return codec.decode(get_meta_attr(envelope.meta, 'codec_meta', {}), data)
@@ -0,0 +1,152 @@
+"""Compression of envelope data sections.
+
+A compressed envelope has `compression` (the name of the method) and `uncompressed_length` in its metadata.
+Data is compressed and decompressed chunk by chunk, so large (e.g. mmapped) data sections
+are never held in memory twice. Data smaller than a threshold is not compressed at all.
+
+A receiver lists the methods it understands in `accept_compression` of its request,
+the sender uses the first one it has too (see `negotiate`).
+"""
+
+import lzma
+import zlib
+from tempfile import SpooledTemporaryFile, TemporaryFile
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from .envelope import Envelope, _map_file
+from .meta import Meta, get_meta_attr
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+THRESHOLD = 64*1024  # smaller data isn't worth the CPU
+
+
+class Compressor:
+    """`compressor()` and `decompressor()` return objects with `compress(chunk)`, `flush()`
+    and `decompress(chunk)` methods respectively, like those of zlib"""
+
+    def __init__(self, name: str, compressor: Callable[[], Any], decompressor: Callable[[], Any]):
+        self.name = name
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+
+class _LZ4Compressor:
+    # LZ4FrameCompressor needs begin() before the first chunk
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._begun = False
+
+    def compress(self, chunk) -> bytes:
+        header = b'' if self._begun else self._compressor.begin()
+        self._begun = True
+        return header + self._compressor.compress(chunk)
+
+    def flush(self) -> bytes:
+        header = b'' if self._begun else self._compressor.begin()
+        self._begun = True
+        return header + self._compressor.flush()
+
+
+compressors: dict[str, Compressor] = {}
+
+
+def register(compressor: Compressor) -> Compressor:
+    compressors[compressor.name] = compressor
+    return compressor
+
+
+if zstandard is not None:
+    register(Compressor('zstd', lambda: zstandard.ZstdCompressor().compressobj(),
+                        lambda: zstandard.ZstdDecompressor().decompressobj()))
+if lz4 is not None:
+    register(Compressor('lz4', _LZ4Compressor, lz4.frame.LZ4FrameDecompressor))
+register(Compressor('zlib', zlib.compressobj, zlib.decompressobj))
+register(Compressor('lzma', lzma.LZMACompressor, lzma.LZMADecompressor))
+
+
+def accepted() -> list[str]:
+    """Registered methods, the fastest first"""
+    return list(compressors)
+
+
+def negotiate(request_meta: Meta) -> str | None:
+    """The method to compress the response with: the first one accepted by the requester which is registered here"""
+    for name in get_meta_attr(request_meta, 'accept_compression', []) or []:
+        if name in compressors:
+            return name
+    return None
+
+
+def compress(envelope: Envelope, method: str | None, threshold: int = THRESHOLD) -> Envelope:
+    if method is None or envelope.data_length < threshold:
+        return envelope
+    compressor = compressors[method].compressor()
+
+    # Длина сжатых данных заранее неизвестна, а в заголовке DF02 она нужна,
+    # поэтому сжимаем во временный файл, который остаётся в памяти, пока он небольшой
+    output = SpooledTemporaryFile(Envelope._MAX_SIZE)
+    for chunk in envelope.iter_chunks():
+        output.write(compressor.compress(chunk))
+    output.write(compressor.flush())
+    length = output.tell()
+    output.seek(0)
+
+    meta = dict(envelope.meta, compression=method, uncompressed_length=envelope.data_length)
+    if length < Envelope._MAX_SIZE:
+        data = output.read()
+        output.close()
+        return Envelope(meta, data)
+    return Envelope(meta, output, tmp_file=output, data_length=length)
+
+
+def decompress(envelope: Envelope) -> Envelope:
+    """The envelope with the decompressed data; envelopes without `compression` are returned as they are"""
+    method = get_meta_attr(envelope.meta, 'compression')
+    if method is None:
+        return envelope
+    if method not in compressors:
+        raise ValueError(f'compression {method} is not supported, install its package')
+
+    meta = {k: v for k, v in envelope.meta.items() if k not in ('compression', 'uncompressed_length')}
+    length = get_meta_attr(envelope.meta, 'uncompressed_length')
+    chunks = _decompress_chunks(compressors[method], envelope.iter_chunks())
+
+    if length < Envelope._MAX_SIZE:
+        data = bytearray(length)
+        _fill(memoryview(data), chunks)
+        return Envelope(meta, data)
+
+    tmp_file = TemporaryFile('w+b')
+    for chunk in chunks:
+        tmp_file.write(chunk)
+    tmp_file.flush()
+    return Envelope(meta, _map_file(tmp_file, 0, length), tmp_file)
+
+
+def _decompress_chunks(compressor: Compressor, chunks: Iterable) -> Iterator[bytes]:
+    decompressor = compressor.decompressor()
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    flush = getattr(decompressor, 'flush', None)  # zlib
+    if flush is not None:
+        yield flush()
+
+
+def _fill(buffer: memoryview, chunks: Iterable[bytes]) -> None:
+    position = 0
+    for chunk in chunks:
+        if position + len(chunk) > len(buffer):
+            raise ValueError('decompressed data is longer than uncompressed_length')
+        buffer[position : position + len(chunk)] = chunk
+        position += len(chunk)
+    if position != len(buffer):
+        raise ValueError('decompressed data is shorter than uncompressed_length')
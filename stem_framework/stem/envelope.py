@@ -1,10 +1,11 @@
-from math import ceil
 import mmap
+import os
+import socket
 from tempfile import TemporaryFile
 from asyncio import StreamReader, StreamWriter
 from io import BufferedRWPair, RawIOBase, BufferedReader, BytesIO, UnsupportedOperation
 from json import JSONEncoder
-from typing import IO, Union, Dict, BinaryIO
+from typing import IO, Any, Union, Dict, BinaryIO, Iterable, Iterator
 from dataclasses import is_dataclass, asdict
 import json
 from .meta import Meta
@@ -27,47 +28,97 @@ class MetaEncoder(JSONEncoder):
 
 
 class Envelope:
+    """DF02 envelope: a header, JSON metadata and a data section.
+
+    The data is either a binary buffer, a binary file (read from its current position)
+    or an iterable of binary chunks; for the last one `data_length` must be given.
+    The data section is written in chunks of `_CHUNK_SIZE` bytes,
+    so it's never copied or loaded into memory as a whole.
+    """
     _MAX_SIZE = 128*1024*1024 # 128 Mb
+    _HEADER_SIZE = 20
+    _CHUNK_SIZE = 1024*1024
 
-    def __init__(self, meta: Meta, data: Binary = b'', tmp_file: IO | None = None):
+    def __init__(self, meta: Meta, data: Binary | IO[bytes] | Iterable[Binary] = b'', tmp_file: IO | None = None,
+                 data_length: int | None = None):
         self.meta = meta
         self.data = data
         self.tmp_file = tmp_file
+        self._data_length = data_length
+        self._data_file: tuple[IO, int] | None = None  # the file and the offset, if the data is mapped from a file
 
     def __str__(self):
         return str(self.meta)
 
-    @staticmethod
-    def read(input: BufferedReader | BytesIO | BinaryIO | BufferedRWPair) -> "Envelope":
-        assert b'#~'   == input.read(2), "Envelope header doesn't start with b'#~'"
-        assert b'DF02' == input.read(4), "Envelope type (version) is not DF02"
-        input.read(2) # MetaType: XML or YAML
-
-        metaLength = int.from_bytes(input.read(4))
-        dataLength = int.from_bytes(input.read(4))
+    @property
+    def data_length(self) -> int:
+        if self._data_length is not None:
+            return self._data_length
+        if isinstance(self.data, Binary):
+            return memoryview(self.data).nbytes
+        if _is_file(self.data):
+            return os.fstat(self.data.fileno()).st_size - self.data.tell()  # type: ignore
+        raise ValueError('data_length must be given for the data which is an iterator')
 
-        assert b'~#\r\n' == input.read(4), r"Envelope header doesn't end with b'~#\r\n'"
+    @staticmethod
+    def read_header(input: BufferedReader | BytesIO | BinaryIO | BufferedRWPair) -> tuple[Meta, int]:
+        """Reads the header and the metadata, returns the metadata and the length of the data"""
+        metaLength, dataLength = Envelope._unpack_header(_read_exactly(input, Envelope._HEADER_SIZE))
+        meta = json.loads(_read_exactly(input, metaLength))
+        return meta, dataLength
 
-        meta = json.loads(input.read(metaLength))
+    @staticmethod
+    def read(input: BufferedReader | BytesIO | BinaryIO | BufferedRWPair) -> "Envelope":
+        meta, dataLength = Envelope.read_header(input)
         tmp_file = None
 
+        data_file = None
+
         if dataLength < Envelope._MAX_SIZE:
-            data = input.read(dataLength)
+            data = _read_exactly(input, dataLength)
         else:
             try:
-                data = mmap.mmap(input.fileno(), dataLength, offset = input.tell())
+                data_file = input, input.tell()
+                data = _map_file(input, input.tell(), dataLength)
+                input.seek(dataLength, os.SEEK_CUR)
                 # an exception will mean that input doesn't support random access
                 # and we will need to create a tmp file
-            except UnsupportedOperation:
-                tmp_file = TemporaryFile('rwb')
+            except (UnsupportedOperation, AttributeError, OSError):
+                tmp_file = TemporaryFile('w+b')
                 # write input to tmp by chuncks:
-                for _ in range(ceil(dataLength / Envelope._MAX_SIZE)):
-                    tmp_file.write(input.read(Envelope._MAX_SIZE))
+                for chunk in _iter_exactly(input, dataLength, Envelope._CHUNK_SIZE):
+                    tmp_file.write(chunk)
                 tmp_file.flush()
 
-                data = mmap.mmap(tmp_file.fileno(), dataLength)
+                data_file = tmp_file, 0
+                data = _map_file(tmp_file, 0, dataLength)
 
-        return Envelope(meta, data, tmp_file)
+        envelope = Envelope(meta, data, tmp_file)
+        envelope._data_file = data_file
+        return envelope
+
+    @staticmethod
+    def recv(sock: socket.socket) -> "Envelope":
+        """Reads an envelope from the socket with `recv_into`, straight into preallocated buffers.
+        Large data goes to an anonymous mmap, i.e. into memory which the OS may swap out."""
+        header = bytearray(Envelope._HEADER_SIZE)
+        _recv_exactly(sock, memoryview(header))
+        metaLength, dataLength = Envelope._unpack_header(header)
+
+        meta_str = bytearray(metaLength)
+        _recv_exactly(sock, memoryview(meta_str))
+
+        data: bytearray | mmap.mmap = bytearray(dataLength) if dataLength < Envelope._MAX_SIZE else mmap.mmap(-1, dataLength)
+        _recv_exactly(sock, memoryview(data))
+        return Envelope(json.loads(meta_str), data)
+
+    @staticmethod
+    def read_stream(input: BufferedReader | BytesIO | BinaryIO | BufferedRWPair,
+                    chunk_size: int = _CHUNK_SIZE) -> "Envelope":
+        """Reads only the header and the metadata: the data is an iterator of chunks read from the input on demand.
+        The data must be read through (or written somewhere) before anything else is read from the input."""
+        meta, dataLength = Envelope.read_header(input)
+        return Envelope(meta, _iter_exactly(input, dataLength, chunk_size), data_length=dataLength)
 
 
     def __del__(self):
@@ -81,6 +132,56 @@ class Envelope:
         return Envelope.read(BytesIO(buffer))
 
 
+    @staticmethod
+    def from_buffer(buffer: Binary) -> "Envelope":
+        """Zero-copy version of `from_bytes`: data of the envelope is a memoryview of the buffer.
+        Useful for mmapped files."""
+        view = memoryview(buffer)
+        metaLength, dataLength = Envelope._unpack_header(view[:Envelope._HEADER_SIZE])
+
+        meta_end = Envelope._HEADER_SIZE + metaLength
+        meta = json.loads(bytes(view[Envelope._HEADER_SIZE : meta_end]))
+        data = view[meta_end : meta_end + dataLength]
+        assert len(data) == dataLength, "Envelope data is truncated"
+
+        return Envelope(meta, data)
+
+
+    @staticmethod
+    def _unpack_header(header: Binary) -> tuple[int, int]:
+        header = bytes(header)
+        assert header[0:2]   == b'#~',     "Envelope header doesn't start with b'#~'"
+        assert header[2:6]   == b'DF02',   "Envelope type (version) is not DF02"
+        # header[6:8] is MetaType: XML or YAML
+        assert header[16:20] == b'~#\r\n', r"Envelope header doesn't end with b'~#\r\n'"
+        return int.from_bytes(header[8:12]), int.from_bytes(header[12:16])
+
+
+    def header(self) -> bytes:
+        """The header and the metadata"""
+        meta_str = bytes(json.dumps(self.meta, cls=MetaEncoder), 'utf8')
+        return b''.join([
+            b'#~', b'DF02', b'..',
+            len(meta_str).to_bytes(4),
+            self.data_length.to_bytes(4),
+            b'~#\r\n',
+            meta_str
+        ])
+
+
+    def iter_chunks(self, chunk_size: int = _CHUNK_SIZE) -> Iterator[Binary]:
+        """The data section in chunks of at most `chunk_size` bytes.
+        Chunks of a buffer are its memoryviews, so nothing is copied."""
+        if isinstance(self.data, Binary):
+            view = memoryview(self.data).cast('B')
+            for start in range(0, len(view), chunk_size):
+                yield view[start : start + chunk_size]
+        elif _is_file(self.data):
+            yield from _iter_exactly(self.data, self.data_length, chunk_size)  # type: ignore
+        else:
+            yield from self.data  # type: ignore
+
+
     def to_bytes(self) -> bytes:
         output = BytesIO()
         self.write_to(output)
@@ -88,50 +189,118 @@ class Envelope:
         return output.read()
 
 
-    def write_to(self, output: RawIOBase | BytesIO | BinaryIO | BufferedRWPair | StreamWriter):
-        output.write(b'#~')
-        output.write(b'DF02')
-        output.write(b'..')
-        meta_str = bytes(json.dumps(self.meta), 'utf8')
+    def write_to(self, output: RawIOBase | BytesIO | BinaryIO | BufferedRWPair | StreamWriter | socket.socket):
+        if isinstance(output, socket.socket):
+            self.send(output)
+            return
+        output.write(self.header())
+        for chunk in self.iter_chunks():
+            output.write(chunk)
+
+
+    def send(self, sock: socket.socket):
+        """Sends the envelope to the socket.
+        Data of a file or mapped from a file is sent by `sendfile`, i.e. without copying it through Python."""
+        header = self.header()
+        data_file = self._data_file
+        if data_file is None and _is_file(self.data):
+            data_file = self.data, self.data.tell()  # type: ignore
+
+        if data_file is not None:
+            sock.sendall(header)
+            _send_file(sock, data_file[0], data_file[1], self.data_length)
+        elif isinstance(self.data, Binary) and self.data_length <= Envelope._CHUNK_SIZE:
+            sock.sendall(header + self.data)  # one segment for a small envelope
+        else:
+            sock.sendall(header)
+            for chunk in self.iter_chunks():
+                sock.sendall(chunk)
 
-        output.write(len(meta_str ).to_bytes(4))
-        output.write(len(self.data).to_bytes(4))
-        output.write(b'~#\r\n')
 
-        output.write(meta_str)
-        if isinstance(output, BinaryIO | StreamWriter):
-            output.write(self.data[:])  # hope it doesn't load the entire file into memory
-        else:                           # otherwise we need to write in chuncks
-            output.write(self.data)
+    @staticmethod
+    async def async_read_header(reader: StreamReader) -> tuple[Meta, int]:
+        metaLength, dataLength = Envelope._unpack_header(await reader.readexactly(Envelope._HEADER_SIZE))
+        meta = json.loads(await reader.readexactly(metaLength))
+        return meta, dataLength
 
 
     @staticmethod
     async def async_read(reader: StreamReader) -> "Envelope":
-        assert b'#~'   == await reader.read(2), "Envelope header doesn't start with b'#~'"
-        assert b'DF02' == await reader.read(4), "Envelope type (version) is not DF02"
-        await reader.read(2) # MetaType: XML or YAML
-
-        metaLength = int.from_bytes(await reader.read(4))
-        dataLength = int.from_bytes(await reader.read(4))
-
-        assert b'~#\r\n' == await reader.read(4), r"Envelope header doesn't end with b'~#\r\n'"
-
-        meta = json.loads(await reader.read(metaLength))
+        meta, dataLength = await Envelope.async_read_header(reader)
         tmp_file = None
 
         if dataLength < Envelope._MAX_SIZE:
-            data = await reader.read(dataLength)
+            data = await reader.readexactly(dataLength)
         else:
-            tmp_file = TemporaryFile('rwb')
+            tmp_file = TemporaryFile('w+b')
             # write input to tmp in chuncks:
-            for _ in range(ceil(dataLength / Envelope._MAX_SIZE)):
-                tmp_file.write(await reader.read(Envelope._MAX_SIZE))
+            left = dataLength
+            while left > 0:
+                chunk = await reader.readexactly(min(left, Envelope._CHUNK_SIZE))
+                tmp_file.write(chunk)
+                left -= len(chunk)
             tmp_file.flush()
 
-            data = mmap.mmap(tmp_file.fileno(), dataLength)
+            data = _map_file(tmp_file, 0, dataLength)
 
         return Envelope(meta, data, tmp_file)
 
 
     async def async_write_to(self, writer: StreamWriter):
-        self.write_to(writer)
\ No newline at end of file
+        writer.write(self.header())
+        for chunk in self.iter_chunks():
+            writer.write(chunk)
+            await writer.drain()  # the writer's buffer doesn't grow beyond a chunk
+        await writer.drain()
+
+
+def _is_file(data: Any) -> bool:
+    return hasattr(data, 'read') and hasattr(data, 'fileno')
+
+
+def _read_exactly(input: Any, size: int) -> bytes:
+    data = input.read(size)
+    if len(data) < size:
+        # Сокет может вернуть меньше, чем просили
+        parts = [data]
+        while size > (got := sum(map(len, parts))):
+            part = input.read(size - got)
+            if not part:
+                raise EOFError(f'Envelope is truncated: {got} of {size} bytes')
+            parts.append(part)
+        data = b''.join(parts)
+    return data
+
+
+def _iter_exactly(input: Any, size: int, chunk_size: int) -> Iterator[bytes]:
+    left = size
+    while left > 0:
+        chunk = _read_exactly(input, min(left, chunk_size))
+        left -= len(chunk)
+        yield chunk
+
+
+def _recv_exactly(sock: socket.socket, buffer: memoryview) -> None:
+    received = 0
+    while received < len(buffer):
+        n = sock.recv_into(buffer[received:])
+        if n == 0:
+            raise EOFError(f'Envelope is truncated: {received} of {len(buffer)} bytes')
+        received += n
+
+
+def _send_file(sock: socket.socket, file: Any, offset: int, count: int) -> None:
+    # socket.sendfile сдвигает позицию файла, а файл может читаться дальше
+    position = file.tell()
+    try:
+        sock.sendfile(file, offset, count)
+    finally:
+        file.seek(position)
+
+
+def _map_file(file: Any, offset: int, length: int) -> memoryview:
+    """Read-only memoryview of a part of the file.
+    The offset of an mmap must be a multiple of ALLOCATIONGRANULARITY, so a bit more is mapped."""
+    aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+    buffer = mmap.mmap(file.fileno(), length + offset - aligned, offset=aligned, access=mmap.ACCESS_READ)
+    return memoryview(buffer)[offset - aligned:]
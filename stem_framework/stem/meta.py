@@ -8,6 +8,8 @@ Based on the metadata and with the help of the metadata processor, Mr. Nozik dec
 
 from dataclasses import dataclass, is_dataclass
 from typing import Any, Tuple, Type, Union
+import hashlib
+import json
 
 from .core import Dataclass
 
@@ -157,3 +159,25 @@ def update_meta(meta: Meta, **kwargs):
     else:
         # then it should be a dict
         meta.update(kwargs)
+
+
+def meta_hash(meta: Meta) -> str:
+    """Canonical hash of the metadata.
+
+    Equal trees of values give equal hashes,
+    regardless of the order of the keys and of whether the tree is made of dicts or dataclasses.
+    Hidden fields created by `update_meta` are taken into account too.
+    """
+    canonical = json.dumps(meta, sort_keys=True, default=_canonical_value)
+    return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+
+def _canonical_value(obj: Any) -> Any:
+    if is_dataclass(obj):
+        return vars(obj)    # not asdict(), because asdict() skips hidden fields
+    elif isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    elif hasattr(obj, 'tolist'):
+        return obj.tolist() # numpy arrays and scalars
+    else:
+        return repr(obj)
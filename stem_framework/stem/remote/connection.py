@@ -0,0 +1,149 @@
+"""Keep-alive connections to units.
+
+A `ConnectionPool` holds a few connections to one (address, port).
+Every request gets a `request_id` in its meta and the unit returns it in the response,
+so several requests may be in flight on the same connection: a reader thread of the connection
+hands each response to the request it belongs to.
+"""
+
+import logging
+import socket
+from concurrent.futures import Future
+from itertools import count
+from threading import Lock, Thread
+
+from stem.envelope import Envelope
+from stem.meta import get_meta_attr
+
+_request_ids = count(1)
+
+
+class Connection:
+
+    def __init__(self, address: str, port: int, connect_timeout: float | None = None):
+        self.socket = socket.create_connection((address, port), connect_timeout)
+        self.socket.settimeout(None)
+        self.closed = False
+        self._pending: dict[int, Future] = {}
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._reader = Thread(target=self._read_responses, daemon=True, name=f'stem-connection-{address}:{port}')
+        self._reader.start()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def request(self, envelope: Envelope) -> Future:
+        """Sends the request, the future is resolved with the response"""
+        request_id = next(_request_ids)
+        future: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError('the connection is closed')
+            self._pending[request_id] = future
+
+        meta = dict(envelope.meta, request_id=request_id, keep_alive=True)
+        try:
+            with self._send_lock:
+                Envelope(meta, envelope.data, data_length=envelope._data_length).send(self.socket)
+        except OSError as e:
+            self._fail(ConnectionError(e))
+            raise ConnectionError(e) from e
+        return future
+
+    def _read_responses(self):
+        while True:
+            try:
+                response = Envelope.recv(self.socket)
+            except (EOFError, OSError) as e:
+                self._fail(ConnectionError(f'the connection is closed: {e!r}'))
+                return
+
+            with self._lock:
+                future = self._pending.pop(get_meta_attr(response.meta, 'request_id'), None)
+                if future is None and len(self._pending) == 1:
+                    # a unit which doesn't know about request_id
+                    future = self._pending.pop(next(iter(self._pending)))
+            if future is None:
+                logging.warning(f'response to an unknown request: {response.meta}')
+            else:
+                future.set_result(response)
+
+    def _fail(self, error: Exception):
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+        self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+class ConnectionPool:
+    """Up to `max_connections` keep-alive connections to a unit.
+    A request goes to an idle connection, to a new one, or to the least busy one."""
+
+    def __init__(self, address: str, port: int, max_connections: int = 4, connect_timeout: float | None = 10):
+        self.address = address
+        self.port = port
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self._connections: list[Connection] = []
+        self._lock = Lock()
+
+    def _acquire(self) -> tuple[Connection, bool]:
+        """A connection and whether it was used before"""
+        with self._lock:
+            self._connections = [c for c in self._connections if not c.closed]
+            idle = [c for c in self._connections if c.in_flight == 0]
+            if idle:
+                return idle[0], True
+            if len(self._connections) < self.max_connections:
+                connection = Connection(self.address, self.port, self.connect_timeout)
+                self._connections.append(connection)
+                return connection, False
+            return min(self._connections, key=lambda c: c.in_flight), True
+
+    def request(self, envelope: Envelope, timeout: float | None = None) -> Envelope:
+        while True:
+            connection, reused = self._acquire()
+            try:
+                return connection.request(envelope).result(timeout)
+            except ConnectionError:
+                # Юнит мог закрыть простаивавшее соединение, тогда повторяем запрос по новому
+                if not reused:
+                    raise
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+
+_pools: dict[tuple[str, int], ConnectionPool] = {}
+_pools_lock = Lock()
+
+
+def get_pool(address: str, port: int) -> ConnectionPool:
+    """The shared pool of connections to the unit"""
+    with _pools_lock:
+        if (address, port) not in _pools:
+            _pools[address, port] = ConnectionPool(address, port)
+        return _pools[address, port]
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -43,7 +43,7 @@ class Distributor:
             case 'powerfullity':
                 response = Envelope({
                     'status': 'fulfilled',
-                    'powerfullity': sum(server.RequestHandlerClass.powerfullity for server in self.servers)
+                    'powerfullity': sum(server.powerfullity for server in self.servers)
                 }).to_bytes()
 
             case 'stop':
@@ -66,7 +66,7 @@ class Distributor:
 
     def select_server(self) -> TCPServer | None:
         if len(self.free_servers) >= 1:
-            weights = np.array([server.RequestHandlerClass.powerfullity for server in self.free_servers])
+            weights = np.array([server.powerfullity for server in self.free_servers])
             weights /= sum(weights)
             selected_server = np.random.choice(np.array(self.free_servers), 1, p = weights)[0]
             self.free_servers.remove(selected_server)
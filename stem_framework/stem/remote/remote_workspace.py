@@ -1,14 +1,14 @@
-import json
-import mmap
-import socket
-from io import BytesIO
-
-from typing import Any, Iterator, TypeVar, List
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+from typing import Any, Iterator, Optional, TypeVar, List, Union
 
 from stem.meta import Meta, get_meta_attr
 from stem.task import Task
-from stem.workspace import IWorkspace
+from stem.workspace import IWorkspace, TaskPath
+from stem import codec, compression
 from stem.envelope import Envelope
+from stem.remote.connection import get_pool
 
 T = TypeVar("T")
 
@@ -20,29 +20,28 @@ class RemoteTask(Task):
         self.port = port
 
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
-        with socket.create_connection((self.address, self.port)) as socket_obj:
-            socket_as_file = socket_obj.makefile('rwb')
-            
-            request = Envelope({
-                'command': 'run',
-                'task_path': self.task_path,
-                'task_meta': meta
-            })
-            request.write_to(socket_as_file)
-            socket_as_file.flush()
-
-            response = Envelope.read(socket_as_file)
+        request = Envelope({
+            'command': 'run',
+            'task_path': self.task_path,
+            'task_meta': meta,
+            'accept_compression': compression.accepted()
+        })
+        response = get_pool(self.address, self.port).request(request)
 
         if get_meta_attr(response.meta, 'status') != 'fulfilled':
             raise ValueError(response.meta)
 
-        if isinstance(response.data, mmap.mmap):
-            return json.load(response.data)
-        else:
-            return json.load(BytesIO(response.data))
+        return codec.decode(response)
 
 
 class RemoteWorkspace(IWorkspace):
+    """Workspace of a unit.
+
+    The structure of the unit is cached for `ttl` seconds and is shared by all workspaces of the unit.
+    After that it is revalidated by its etag: the unit sends the structure again only if it has changed.
+    """
+
+    ttl: float = 5.0
 
     def __init__(self, address="localhost", port=8888, workspace_path = ''):
         self.address = address
@@ -50,21 +49,7 @@ class RemoteWorkspace(IWorkspace):
         self.workspace_path = workspace_path   # путь от корневого workspace сервера
 
     def structure(self) -> dict[str, object]:
-        with socket.create_connection((self.address, self.port)) as socket_obj:
-            socket_as_file = socket_obj.makefile('rwb')
-
-            Envelope({'command': 'structure'}).write_to(socket_as_file)
-            socket_as_file.flush()
-
-            response = Envelope.read(socket_as_file)
-
-        if get_meta_attr(response.meta, 'status') != 'fulfilled':
-            raise ValueError(response.meta)
-
-        if isinstance(response.data, mmap.mmap):
-            structure = json.load(response.data)
-        else:
-            structure = json.load(BytesIO(response.data))
+        structure = _structure_cache.get(self.address, self.port, self.ttl).structure
 
         for subworkspace_name in self.workspace_path.split('.'):
             for subworkspace in structure['workspaces']:
@@ -80,13 +65,15 @@ class RemoteWorkspace(IWorkspace):
 
     @property
     def tasks(self) -> dict[str, Task]:
-
-        task_paths = _get_task_paths_from_structure(self.workspace_path, self.structure())
-
-        return {
-            task_path: RemoteTask(task_path, self.address, self.port)
-            for task_path in task_paths
-        }
+        entry = _structure_cache.get(self.address, self.port, self.ttl)
+        # RemoteTask создаются заново, только если структура на юните изменилась
+        if self.workspace_path not in entry.tasks:
+            task_paths = _get_task_paths_from_structure(self.workspace_path, self.structure())
+            entry.tasks[self.workspace_path] = {
+                task_path: RemoteTask(task_path, self.address, self.port)
+                for task_path in task_paths
+            }
+        return entry.tasks[self.workspace_path]
 
     @property
     def workspaces(self) -> set["IWorkspace"]:
@@ -98,6 +85,66 @@ class RemoteWorkspace(IWorkspace):
             for workspace_path in workspace_paths
         )
 
+    def find_task(self, task_path: Union[str, TaskPath]) -> Optional[Task]:  # type: ignore
+        """Looks the task up in the cached structure, without walking the subworkspaces"""
+        path = '.'.join(task_path._path) if isinstance(task_path, TaskPath) else task_path
+        tasks = self.tasks
+        if (task := tasks.get(self.workspace_path + path)) is not None:
+            return task
+        if '.' not in path:
+            # a task of a subworkspace, the nearest one
+            for full_path in sorted(tasks, key=lambda p: p.count('.')):
+                if full_path.rsplit('.', 1)[-1] == path:
+                    return tasks[full_path]
+        return None
+
+
+@dataclass
+class _StructureEntry:
+    structure: dict
+    etag: str | None
+    fetched_at: float
+    tasks: dict[str, dict[str, Task]] = field(default_factory=dict)  # workspace path -> tasks
+
+
+class _StructureCache:
+
+    def __init__(self):
+        self._entries: dict[tuple[str, int], _StructureEntry] = {}
+        self._lock = Lock()
+
+    def get(self, address: str, port: int, ttl: float) -> _StructureEntry:
+        with self._lock:
+            entry = self._entries.get((address, port))
+        if entry is not None and monotonic() - entry.fetched_at < ttl:
+            return entry
+
+        request = Envelope({
+            'command': 'structure',
+            'accept_compression': compression.accepted(),
+            'if_none_match': entry.etag if entry is not None else None
+        })
+        response = get_pool(address, port).request(request)
+        status = get_meta_attr(response.meta, 'status')
+
+        if status == 'not_modified' and entry is not None:
+            entry.fetched_at = monotonic()
+            return entry
+        if status != 'fulfilled':
+            raise ValueError(response.meta)
+
+        entry = _StructureEntry(codec.decode(response), get_meta_attr(response.meta, 'etag'), monotonic())
+        with self._lock:
+            self._entries[address, port] = entry
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_structure_cache = _StructureCache()
+
 
 def _get_task_paths_from_structure(prefix: str, structure: dict) -> Iterator[str]:
     for task_name in structure['tasks']:
@@ -1,29 +1,50 @@
+import asyncio
+import hashlib
 import json
 import logging
-from socketserver import StreamRequestHandler, TCPServer
-from threading import Thread
+import socket
+from concurrent.futures import Executor, ThreadPoolExecutor
+from socketserver import StreamRequestHandler, TCPServer, ThreadingTCPServer
+from threading import Event, Lock, Thread
 from multiprocessing import Process
 from typing import Optional, Tuple, Type
 
+from stem import codec, compression
 from stem.envelope import Envelope
 from stem.task_master import TaskMaster, TaskStatus
+from stem.task_runner import materialize
 from stem.task_tree import TaskTree
 from stem.workspace import IWorkspace
 from stem.meta import get_meta_attr
 
 
-class UnitHandler(StreamRequestHandler):
-    workspace: IWorkspace | Type[IWorkspace]
-    task_tree: TaskTree | None
-    task_master: TaskMaster
-    powerfullity: int | None
+class Unit:
+    """Answers requests to a workspace, independently of the server which receives them"""
 
-    def handle(self) -> None:
-        logging.debug('handle entered')
-        request = Envelope.read(self.rfile)
+    def __init__(self, workspace: IWorkspace | Type[IWorkspace], powerfullity: int | None = 666,
+                 task_master: TaskMaster | None = None):
+        self.workspace = workspace
+        self.task_tree: TaskTree | None = None
+        self.task_master = task_master if task_master is not None else TaskMaster()
+        self.powerfullity = powerfullity
+        self.codecs: tuple[str, ...] = codec.DEFAULT_CODECS  # the first one which can encode a result is used
+        self.compression_threshold: int = compression.THRESHOLD
 
+    def process_request(self, request: Envelope) -> Envelope:
+        """The response to the request, with the `request_id` of the request"""
         logging.debug(f"server receives command: {get_meta_attr(request.meta, 'command')}")
+        try:
+            resp = self._dispatch(request)
+        except Exception as e:
+            logging.exception('request failed')
+            resp = Envelope({'status': 'failed', 'error': repr(e)})
 
+        resp = compression.compress(resp, compression.negotiate(request.meta), self.compression_threshold)
+        if (request_id := get_meta_attr(request.meta, 'request_id')) is not None:
+            resp.meta = dict(resp.meta, request_id=request_id)
+        return resp
+
+    def _dispatch(self, request: Envelope) -> Envelope:
         match get_meta_attr(request.meta, 'command'):
             case 'run':
                 task_path = get_meta_attr(request.meta, 'task_path')
@@ -40,11 +61,8 @@ class UnitHandler(StreamRequestHandler):
                         self.workspace
                     )
                     if res.status == TaskStatus.CONTAINS_DATA:
-                        data = res.lazy_data()
-                        resp = Envelope(
-                            {'status': 'fulfilled'},
-                            json.dumps(data).encode('utf8')
-                        )
+                        data = materialize(res.lazy_data())
+                        resp = codec.encode(data, {'status': 'fulfilled'}, self.codecs)
                     else:
                         resp = Envelope({
                             'status': 'failed',
@@ -53,10 +71,12 @@ class UnitHandler(StreamRequestHandler):
 
             case 'structure':
                 structure = self.workspace.structure()
-                resp = Envelope(
-                    {'status': 'fulfilled'},
-                    json.dumps(structure).encode('utf8')
-                )
+                # по etag клиент узнаёт, что его копия структуры ещё актуальна
+                etag = hashlib.sha256(json.dumps(structure, sort_keys=True).encode('utf8')).hexdigest()
+                if get_meta_attr(request.meta, 'if_none_match') == etag:
+                    resp = Envelope({'status': 'not_modified', 'etag': etag})
+                else:
+                    resp = codec.encode(structure, {'status': 'fulfilled', 'etag': etag}, 'json')
 
             case 'powerfullity':
                 resp = Envelope({
@@ -80,26 +100,187 @@ class UnitHandler(StreamRequestHandler):
                     'error' : 'input_envelope.meta.command = ???'
                 })
 
+        return resp
+
+
+class UnitHandler(StreamRequestHandler):
+    unit: Unit
+    timeout = 60  # seconds, an idle keep-alive connection is closed after it
+
+    def handle(self) -> None:
+        logging.debug('handle entered')
+        # Клиент с keep_alive присылает по одному соединению много запросов,
+        # остальные закрывают соединение после первого ответа
+        while True:
+            try:
+                request = Envelope.read(self.rfile)
+            except (EOFError, OSError):  # the client closed the connection or was idle for too long
+                return
+
+            resp = self.unit.process_request(request)
+            logging.info(f'server sends: {resp.meta}')
+            # маленький ответ уходит одним send, данные из файла — через sendfile
+            resp.send(self.connection)
+
+            if not get_meta_attr(request.meta, 'keep_alive', False):
+                return
+
+
+class UnitServer(ThreadingTCPServer):
+    """Every connection is served in its own thread, since keep-alive connections stay open between requests.
+    Connections which are still open are closed by `server_close`."""
+    allow_reuse_address = True # иначе нужно будет ждать минуту, прежде чем перезапускать сервер
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, server_address, RequestHandlerClass):
+        super().__init__(server_address, RequestHandlerClass)
+        self._connections: set[socket.socket] = set()
+        self._connections_lock = Lock()
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.discard(request)
+        super().shutdown_request(request)
+
+    @property
+    def powerfullity(self) -> int | None:
+        return self.RequestHandlerClass.unit.powerfullity  # type: ignore
+
+    def server_close(self):
+        super().server_close()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class AsyncUnitServer:
+    """Unit server on asyncio: every connection and every request on it are served concurrently.
+
+    `run` commands are executed on `executor` (a pool of `max_concurrency` threads by default),
+    at most `max_concurrency` of them at once; the others wait for their turn,
+    while cheap commands (`structure`, `powerfullity`) are answered right away.
+    Responses to keep-alive requests are sent as soon as they are ready, in any order, with their `request_id`.
+
+    The interface is that of `socketserver.TCPServer`: `serve_forever`, `shutdown` from another thread, `server_close`.
+    """
+
+    idle_timeout = 60  # seconds, an idle keep-alive connection is closed after it
+
+    def __init__(self, server_address: tuple[str, int], unit: Unit,
+                 max_concurrency: int | None = None, executor: Executor | None = None):
+        self.unit = unit
+        self.max_concurrency = max_concurrency or 4
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(self.max_concurrency)
+
+        # Сокет открывается сразу, чтобы клиенты могли подключаться ещё до serve_forever
+        self.socket = socket.create_server(server_address, reuse_port=False)
+        self.server_address = self.socket.getsockname()[:2]
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop: asyncio.Event | None = None
+        self._stopped = Event()
+        self._stopped.set()
+
+    @property
+    def powerfullity(self) -> int | None:
+        return self.unit.powerfullity
+
+    def serve_forever(self) -> None:
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._connections: set[asyncio.StreamWriter] = set()
+        server = await asyncio.start_server(self._handle, sock=self.socket)
+        async with server:
+            await self._stop.wait()
+            for writer in list(self._connections):
+                writer.close()
+        self._loop = None
+
+    def shutdown(self) -> None:
+        """Stops `serve_forever` and waits for it, must be called from another thread"""
+        loop, stop = self._loop, self._stop
+        if loop is not None and stop is not None:
+            try:
+                loop.call_soon_threadsafe(stop.set)
+            except RuntimeError:  # the loop is already closed
+                pass
+        self._stopped.wait()
+
+    def server_close(self) -> None:
+        self.socket.close()
+        if self._own_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        write_lock = asyncio.Lock()
+        responding: set[asyncio.Task] = set()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(Envelope.async_read(reader), self.idle_timeout)
+                except (EOFError, ConnectionError, OSError, asyncio.TimeoutError):
+                    break
+
+                task = asyncio.create_task(self._respond(request, writer, write_lock))
+                responding.add(task)
+                task.add_done_callback(responding.discard)
+                if not get_meta_attr(request.meta, 'keep_alive', False):
+                    await task
+                    break
+        finally:
+            if responding:
+                await asyncio.gather(*responding, return_exceptions=True)
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _respond(self, request: Envelope, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        if get_meta_attr(request.meta, 'command') == 'run':
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                resp = await loop.run_in_executor(self.executor, self.unit.process_request, request)
+        else:
+            resp = self.unit.process_request(request)
+
         logging.info(f'server sends: {resp.meta}')
+        async with write_lock:
+            await resp.async_write_to(writer)
+
 
-        self.wfile.write(resp.to_bytes()) # если вместо этого написать resp.write_to(self.wfile),
-        self.wfile.flush()                # то будет несколько вызовов wfile.write,
-                                          # но клиент отключается после первого
+def start_unit(workspace: IWorkspace, host: str, port: int, powerfullity = 666,
+               max_concurrency: int | None = None, executor: Executor | None = None) -> AsyncUnitServer:
+    return AsyncUnitServer((host, port), Unit(workspace, powerfullity), max_concurrency, executor)
 
 
-def start_unit(workspace: IWorkspace, host: str, port: int, powerfullity = 666) -> TCPServer:
-    # Нужно создать новый тип, чтобы у серверов могли быть разные powerfullity
+def start_threading_unit(workspace: IWorkspace, host: str, port: int, powerfullity = 666) -> UnitServer:
+    """Unit on socketserver: a thread per connection"""
+    # Нужно создать новый тип, чтобы у серверов могли быть разные unit
     requestHandlerClass = type(f'Server@{host}:{port}', (UnitHandler,), {
-        'workspace': workspace,
-        'task_tree': None,
-        'task_master': TaskMaster(),
-        'powerfullity': powerfullity
+        'unit': Unit(workspace, powerfullity)
     })
-    TCPServer.allow_reuse_address = True # иначе нужно будет ждать минуту, прежде чем перезапускать сервер
-    return TCPServer((host, port), requestHandlerClass)
+    return UnitServer((host, port), requestHandlerClass)
 
 
-def start_unit_in_subprocess(workspace: IWorkspace, host: str, port: int, powerfullity = 666) -> Tuple[Thread, TCPServer]:
+def start_unit_in_subprocess(workspace: IWorkspace, host: str, port: int, powerfullity = 666) -> Tuple[Thread, AsyncUnitServer]:
     server = start_unit(workspace, host, port, powerfullity)
     thread = Thread(target = server.serve_forever)
     thread.start()
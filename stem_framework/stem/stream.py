@@ -0,0 +1,168 @@
+"""Streams connect tasks which run in different threads.
+
+A producer reads an iterator in chunks and puts the chunks into bounded queues, one queue per consumer.
+If a queue is full, the producer waits for the consumer (backpressure),
+so at most `max_chunks` chunks of every stream are held in memory.
+"""
+
+from itertools import islice
+from queue import Queue, Empty, Full
+from threading import Event
+from typing import Any, Generic, Iterable, Iterator, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+_END = object()
+
+
+class _Error:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class StreamError(RuntimeError):
+    pass
+
+
+class Stream(Iterator[T], Generic[T]):
+    """`max_chunks = 0` means an unbounded queue"""
+
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, max_chunks: int = 4):
+        self._queue: Queue = Queue(max_chunks)
+        self._chunk: Iterator[T] = iter(())
+        self._closed = Event()
+        self._producer_exited = Event()
+        self._ended = False
+
+    def __next__(self) -> T:
+        while True:
+            try:
+                return next(self._chunk)
+            except StopIteration:
+                if self._ended:
+                    raise
+                chunk = self._get()
+                if chunk is _END:
+                    self._ended = True
+                    raise StopIteration
+                if isinstance(chunk, _Error):
+                    self._ended = True
+                    raise chunk.exception
+                self._chunk = iter(chunk)
+
+    def _get(self) -> Any:
+        # Ждём с таймаутом, чтобы не зависнуть навсегда,
+        # если производитель завершился, не закрыв поток
+        while True:
+            try:
+                return self._queue.get(timeout=self._POLL_INTERVAL)
+            except Empty:
+                if self.closed:
+                    raise StreamError('the stream was closed')
+                if self._producer_exited.is_set() and self._queue.empty():
+                    raise StreamError('the producer exited without ending the stream')
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def close(self) -> None:
+        """The consumer does not need more items, the producer stops waiting for it"""
+        self._closed.set()
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Empty:
+            pass
+
+    def put(self, chunk: Any) -> None:
+        while not self.closed:
+            try:
+                self._queue.put(chunk, timeout=self._POLL_INTERVAL)
+                return
+            except Full:
+                pass
+
+    def end(self) -> None:
+        self.put(_END)
+
+    def fail(self, exception: BaseException) -> None:
+        self.put(_Error(exception))
+
+
+def pump(source: Iterable[T], streams: list[Stream[T]], chunk_size: int = 1024) -> None:
+    """Reads the source in chunks and puts every chunk into all streams.
+    Returns when the source is exhausted or when all streams are closed.
+    An exception raised by the source is passed to the consumers.
+    Every stream is ended on every way out of the function."""
+    streams = list(streams)
+    iterator = iter(source)
+    try:
+        while any(not s.closed for s in streams):
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            for s in streams:
+                s.put(chunk)
+    except BaseException as e:
+        for s in streams:
+            s.fail(e)
+    else:
+        for s in streams:
+            s.end()     # closed streams ignore it
+    finally:
+        for s in streams:
+            s._producer_exited.set()
+        close = getattr(iterator, 'close', None)   # generators
+        if close is not None:
+            close()
+
+
+class ChunkedIterator(Iterator[T], Generic[T]):
+    """Iterator over the items of NumPy chunks.
+
+    Batched tasks (`MapTask(..., chunk_size=n)` etc.) produce it and take its chunks as they are,
+    any other consumer sees ordinary items.
+    """
+
+    def __init__(self, chunks: Iterable[np.ndarray]):
+        self._chunks = iter(chunks)
+        self._chunk: Iterator[T] = iter(())
+
+    def __next__(self) -> T:
+        while True:
+            try:
+                return next(self._chunk)
+            except StopIteration:
+                self._chunk = iter(next(self._chunks))
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """The remaining items as chunks"""
+        rest = np.asarray(list(self._chunk))
+        if len(rest):
+            yield rest
+        yield from self._chunks
+
+
+def batches(source: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Items of the source as lists of `size` items (the last one may be shorter)"""
+    iterator = iter(source)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def to_chunks(source: Iterable[T], chunk_size: int) -> Iterator[np.ndarray]:
+    """Items of the source as NumPy arrays of `chunk_size` items (the last one may be shorter).
+    Chunks of a `ChunkedIterator` are passed as they are."""
+    if isinstance(source, ChunkedIterator):
+        yield from source.chunks()
+        return
+    for batch in batches(source, chunk_size):
+        yield np.asarray(batch)
@@ -1,11 +1,26 @@
 from typing import Type, TypeVar, Union, Tuple, Callable, Optional, Generic, Any, Iterator, overload
 from abc import ABC, abstractmethod
+import inspect
+import sys
 from .core import Named
 from .meta import Specification, Meta
+from .stream import ChunkedIterator, batches, to_chunks
 from functools import reduce
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextvars import ContextVar
+from copy import deepcopy
+import os
+import numpy as np
 
 T = TypeVar("T")
 
+# Executor of the runner, which is running the task in the current thread.
+# Tasks may submit parts of their work to it, e.g. ReduceTask(..., parallel=True)
+task_executor: ContextVar[Optional[Executor]] = ContextVar('task_executor', default=None)
+
+_NO_VALUE: Any = object()
+
 
 class Task(ABC, Generic[T], Named):
     dependencies: Tuple[Union[str, "Task"], ...]
@@ -16,6 +31,11 @@ class Task(ABC, Generic[T], Named):
     def check_by_meta(self, meta: Meta):
         pass
 
+    @property
+    def is_async(self) -> bool:
+        """True if `transform` returns a coroutine which should be awaited"""
+        return inspect.iscoroutinefunction(self.transform)
+
     @abstractmethod
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         pass
@@ -34,6 +54,10 @@ class FunctionTask(Task[T]):
     def __call__(self, *args, **kwargs):
         return self._func(*args, **kwargs)
 
+    @property
+    def is_async(self) -> bool:
+        return _is_coroutine_function(self._func)
+
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         return self._func(meta, **kwargs)
 
@@ -45,6 +69,10 @@ class DataTask(Task[T]):
     def data(self, meta: Meta) -> T:
         pass
 
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.data)
+
     def transform(self, meta: Meta, /, **kwargs: Any) -> T:
         return self.data(meta)
 
@@ -62,9 +90,27 @@ class FunctionDataTask(DataTask[T]):
     def __call__(self, *args, **kwargs):
         return self._func(*args, **kwargs)
 
+    @property
+    def is_async(self) -> bool:
+        return _is_coroutine_function(self._func)
+
     def data(self, meta: Meta) -> T:
         return self._func(meta)
 
+
+def _caller_module() -> str:
+    """Name of the module where the task object is created:
+    the first frame outside of this module, so that subclasses calling super().__init__ work too"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    return frame.f_globals.get('__name__', __name__) if frame is not None else __name__
+
+
+def _is_coroutine_function(func: Callable) -> bool:
+    # @staticmethod and @classmethod keep the function in __func__
+    return inspect.iscoroutinefunction(getattr(func, '__func__', func))
+
 @overload
 def data(func: Callable[[Meta], T], specification: Specification | None = None, **settings) -> FunctionDataTask[T]:
     pass
@@ -107,9 +153,16 @@ def task(func: Callable[..., T] | None = None, specification: Specification | No
 
 
 class MapTask(Task[Iterator[T]]):
-    def __init__(self, func: Callable, dependence : Union[str, "Task"]):
+    """Applies `func` to every item of the dependence.
+
+    If `chunk_size` is given, the items are collected into NumPy arrays of `chunk_size` items
+    and `func` is applied to whole arrays, so it must be vectorized (a ufunc or an array expression).
+    """
+
+    def __init__(self, func: Callable, dependence : Union[str, "Task"], chunk_size: int | None = None):
 
         self.func = func
+        self.chunk_size = chunk_size
 
         if isinstance(dependence, str):
             self.dependence_name = dependence
@@ -123,16 +176,27 @@ class MapTask(Task[Iterator[T]]):
         # которое возвращает свойство ._name
         # Поэтому следующий костыль:
         self._name = 'map_' + self.dependence_name
+        self.dependencies = (dependence,)
+        self.__module__ = _caller_module()  # for IWorkspace.find_default_workspace
 
     def transform(self, meta: Meta, /, **kwargs: Any):
         # судя по тестам kwargs[dependance_name] это итератор
+        if self.chunk_size is not None:
+            return ChunkedIterator(map(self.func, to_chunks(kwargs[self.dependence_name], self.chunk_size)))
         return map(self.func, kwargs[self.dependence_name])
 
 
 
 class FilterTask(Task[Iterator[T]]):
-    def __init__(self, key: Callable, dependence: Union[str, "Task"]):
+    """Keeps the items of the dependence for which `key` is true.
+
+    If `chunk_size` is given, `key` is applied to NumPy arrays of `chunk_size` items
+    and must return a boolean mask of the array.
+    """
+
+    def __init__(self, key: Callable, dependence: Union[str, "Task"], chunk_size: int | None = None):
         self.key = key
+        self.chunk_size = chunk_size
         
         if isinstance(dependence, str):
             self.dependence_name = dependence
@@ -140,21 +204,120 @@ class FilterTask(Task[Iterator[T]]):
             self.dependence_name = dependence.name
 
         self._name = 'filter_' + self.dependence_name
+        self.dependencies = (dependence,)
+        self.__module__ = _caller_module()
 
     def transform(self, meta: Meta, /, **kwargs: Any):
+        if self.chunk_size is not None:
+            return ChunkedIterator(
+                chunk[self.key(chunk)] for chunk in to_chunks(kwargs[self.dependence_name], self.chunk_size)
+            )
         return filter(self.key, kwargs[self.dependence_name])
 
 
 class ReduceTask(Task[Iterator[T]]):
-    def __init__(self, func: Callable, dependence: Union[str, "Task"]):
+    """Reduces the items of the dependence with `func`.
+
+    If `chunk_size` is given and `func` is a ufunc (e.g. `np.add`, `np.maximum`),
+    every NumPy chunk of `chunk_size` items is reduced by `func.reduce` and then the partial results are.
+    Other functions are applied item by item as without `chunk_size`.
+
+    `identity` is the initial value of the reduction, as in `functools.reduce`.
+
+    If `parallel` is true, `func` must be associative: the input is split into chunks
+    of `chunk_size` (by default `PARALLEL_CHUNK_SIZE`) items, the chunks are reduced concurrently
+    and the partial results are combined in a tree with `combine` (by default `func`).
+    As in Spark's `aggregate`, `func(acc, item)` and `combine(acc, acc)` may differ,
+    then every chunk starts from `identity`.
+    Chunks are reduced on the executor of the runner (see `task_executor`) or on a temporary pool of threads.
+    """
+
+    PARALLEL_CHUNK_SIZE = 1 << 16
+
+    def __init__(self, func: Callable, dependence: Union[str, "Task"], chunk_size: int | None = None, *,
+                 identity: Any = _NO_VALUE, combine: Callable | None = None, parallel: bool = False):
         self.func = func
-        
+        self.chunk_size = chunk_size
+        self.identity = identity
+        self.combine = combine
+        self.parallel = parallel
+
         if isinstance(dependence, str):
             self.dependence_name = dependence
         else:
             self.dependence_name = dependence.name
 
         self._name = 'reduce_' + self.dependence_name
+        self.dependencies = (dependence,)
+        self.__module__ = _caller_module()
 
     def transform(self, meta: Meta, /, **kwargs: Any):
-        return reduce(self.func, kwargs[self.dependence_name])
+        items = kwargs[self.dependence_name]
+        if self.parallel:
+            return self._parallel_reduce(items)
+        if self.chunk_size is not None and isinstance(self.func, np.ufunc):
+            chunks = to_chunks(items, self.chunk_size)
+            return self.func.reduce(np.asarray([self.func.reduce(chunk) for chunk in chunks]))
+        if self.identity is not _NO_VALUE:
+            return reduce(self.func, items, deepcopy(self.identity))
+        return reduce(self.func, items)
+
+    def _reduce_chunk(self, chunk):
+        if isinstance(self.func, np.ufunc):
+            return self.func.reduce(chunk)
+        if self.identity is not _NO_VALUE:
+            # every chunk gets its own copy, func may update the accumulator in place
+            return reduce(self.func, chunk, deepcopy(self.identity))
+        return reduce(self.func, chunk)
+
+    def _parallel_reduce(self, items):
+        chunk_size = self.chunk_size or self.PARALLEL_CHUNK_SIZE
+        if isinstance(self.func, np.ufunc):
+            chunks: Iterator = to_chunks(items, chunk_size)
+        else:
+            chunks = batches(items, chunk_size)
+        combine = self.combine if self.combine is not None else self.func
+
+        executor = task_executor.get()
+        if executor is None:
+            with ThreadPoolExecutor() as executor:
+                return self._tree_reduce(executor, chunks, combine)
+        return self._tree_reduce(executor, chunks, combine)
+
+    def _tree_reduce(self, executor: Executor, chunks: Iterator, combine: Callable):
+        # Не держим в памяти весь вход: одновременно в работе не больше max_pending кусков
+        max_pending = 2 * (os.cpu_count() or 1)
+        pending: deque[_Call] = deque()
+        partials = []
+        for chunk in chunks:
+            if len(pending) >= max_pending:
+                partials.append(pending.popleft().result())
+            pending.append(_Call(executor, self._reduce_chunk, chunk))
+        partials.extend(c.result() for c in pending)
+
+        if not partials:
+            if self.identity is not _NO_VALUE:
+                return deepcopy(self.identity)
+            raise TypeError('reduce() of empty iterable with no initial value')
+
+        # partials are combined pairwise, the order of the items is kept
+        while len(partials) > 1:
+            pairs = [_Call(executor, combine, partials[i], partials[i + 1]) for i in range(0, len(partials) - 1, 2)]
+            partials = [c.result() for c in pairs] + ([partials[-1]] if len(partials) % 2 else [])
+        return partials[0]
+
+
+class _Call:
+    """A function submitted to an executor.
+    If no worker has started it when its result is needed, the caller runs it itself:
+    so a task running on a pool can wait for its own calls on the same pool without a deadlock."""
+
+    def __init__(self, executor: Executor, func: Callable, *args: Any):
+        self.func = func
+        self.args = args
+        self.future = executor.submit(func, *args)
+
+    def result(self) -> Any:
+        if self.future.cancel():
+            return self.func(*self.args)
+        return self.future.result()
@@ -0,0 +1,331 @@
+"""Caches of task results.
+
+A runner consults its cache before computing a node of the task tree.
+If the same task was already computed with the same metadata,
+the whole subtree of the node is not computed again.
+"""
+
+import hashlib
+import inspect
+import mmap
+import os
+import re
+import sys
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from types import CodeType
+from typing import Any, Callable, Hashable, Iterator, MutableMapping
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from . import codec
+from .envelope import Envelope
+from .meta import Meta, get_meta_attr, meta_hash
+from .task import Task
+from .task_tree import TaskNode
+from .workspace import ProxyTask
+
+
+class ResultCache(ABC):
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def key(self, meta: Meta, task_node: TaskNode) -> Hashable:
+        pass
+
+    @abstractmethod
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """Returns (True, value) if the key is in the cache, else (False, None)"""
+
+    @abstractmethod
+    def put(self, key: Hashable, value: Any) -> None:
+        pass
+
+    def lookup(self, meta: Meta, task_node: TaskNode) -> tuple[bool, Any]:
+        found, value = self.get(self.key(meta, task_node))
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found, value
+
+    def store(self, meta: Meta, task_node: TaskNode, value: Any) -> None:
+        """Iterators are not stored: the result of the task is read by its consumers,
+        reading it into a list would defeat lazy and streaming pipelines"""
+        if isinstance(value, Iterator):
+            # Итератор можно прочитать только один раз,
+            # поэтому второй потребитель получил бы пустой итератор
+            return
+        self.put(self.key(meta, task_node), value)
+
+
+class LRUCache(ResultCache):
+    """In-memory cache with least-recently-used eviction.
+
+    An entry is evicted when there are more than `max_entries` entries
+    or when the total size of the values exceeds `max_size` bytes.
+    """
+
+    def __init__(self, max_entries: int | None = 128, max_size: int | None = None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, meta: Meta, task_node: TaskNode) -> Hashable:
+        return task_node.task_path, meta_hash(meta)
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key][0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = value, size
+            self.size += size
+
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) or \
+                  (self.max_size is not None and self.size > self.max_size):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(ResultCache):
+    """Persistent cache: every result is a file in `directory`,
+    so results survive a restart of the process and can be shared between processes.
+
+    Keys are content-addressed (see `content_key`).
+    Files are envelopes (DF02) and are mmapped back when read,
+    thus NumPy arrays are returned as read-only views of the file without copying.
+    """
+
+    def __init__(self, directory: str | os.PathLike):
+        super().__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._keys: WeakKeyDictionary[TaskNode, dict[str, str]] = WeakKeyDictionary()  # memo of content_key
+        self._lock = Lock()
+
+    def key(self, meta: Meta, task_node: TaskNode) -> str:
+        with self._lock:
+            return content_key(meta, task_node, self._keys)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        try:
+            with open(self._path(str(key)), 'rb') as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # ValueError: the file is empty
+            return False, None
+
+        try:
+            envelope = Envelope.from_buffer(buffer)
+            if _is_view(envelope):
+                # the value is a view of the mmap, the mmap is closed when the value is freed
+                return True, _decode(envelope)
+            with envelope.data:
+                value = _decode(envelope)
+        except Exception:
+            # Недописанный или испорченный файл считаем промахом,
+            # при следующем put он будет перезаписан
+            return False, None
+        buffer.close()
+        return True, value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        path = self._path(str(key))
+        path.parent.mkdir(exist_ok=True)
+
+        try:
+            envelope = _encode(value)
+        except Exception:
+            return  # the value can't be pickled, so it is not cached
+
+        # Сначала пишем во временный файл, а потом атомарно переименовываем,
+        # чтобы другой процесс никогда не увидел недописанный файл
+        with tempfile.NamedTemporaryFile('wb', dir=path.parent, delete=False) as file:
+            try:
+                envelope.write_to(file)
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+        os.replace(file.name, path)
+
+
+class TieredCache(ResultCache):
+    """Several caches from the fastest to the slowest, e.g. `TieredCache(LRUCache(), DiskCache(path))`.
+    A value found in a slower cache is put into all faster ones."""
+
+    def __init__(self, *caches: ResultCache):
+        super().__init__()
+        self.caches = caches
+
+    def key(self, meta: Meta, task_node: TaskNode) -> Hashable:
+        return tuple(cache.key(meta, task_node) for cache in self.caches)
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        keys: tuple = key  # type: ignore
+        for i, (cache, k) in enumerate(zip(self.caches, keys)):
+            found, value = cache.get(k)
+            if found:
+                for faster_cache, faster_key in zip(self.caches[:i], keys[:i]):
+                    faster_cache.put(faster_key, value)
+                return True, value
+        return False, None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        keys: tuple = key  # type: ignore
+        for cache, k in zip(self.caches, keys):
+            cache.put(k, value)
+
+
+def content_key(meta: Meta, task_node: TaskNode,
+                _memo: MutableMapping[TaskNode, dict[str, str]] | None = None) -> str:
+    """Hash of the task, of its metadata and, recursively, of all its dependencies.
+
+    A node shared by several paths of the tree is hashed once:
+    keys are memoized per node and metadata in `_memo`.
+    """
+    if _memo is None:
+        _memo = {}
+    mhash = meta_hash(meta)
+    keys = _memo.setdefault(task_node, {})
+    if mhash not in keys:
+        h = hashlib.sha256()
+        h.update(task_node.task_path.encode('utf8'))
+        h.update(_task_fingerprint(task_node.task))
+        h.update(mhash.encode('utf8'))
+        for dependency in sorted(task_node.dependencies, key=lambda t: t.task.name):
+            h.update(content_key(get_meta_attr(meta, dependency.task.name, {}), dependency, _memo).encode('utf8'))
+        keys[mhash] = h.hexdigest()
+    return keys[mhash]
+
+
+def _task_fingerprint(task: Task) -> bytes:
+    """Hash of the code of the task: if the code is changed, old results on disk are not used.
+
+    The code of the task's functions (`_func` of decorated tasks, `func` and `key` of Map/Filter/Reduce tasks,
+    `transform` and `data` methods) is hashed with nested functions and values of closure variables.
+    Functions called by the task are hashed only by name,
+    so a change in a helper function does not change the key.
+    """
+    while isinstance(task, ProxyTask):
+        task = task._task
+    h = hashlib.sha256()
+    h.update(f'{type(task).__module__}.{type(task).__qualname__}'.encode('utf8'))
+    for attr in ('_func', 'func', 'key', 'transform', 'data'):
+        func = getattr(task, attr, None)
+        if callable(func):
+            _hash_function(func, h)
+    return h.digest()
+
+
+def _hash_function(func: Callable, h: Any) -> None:
+    func = getattr(func, '__func__', func)  # methods, @staticmethod and @classmethod
+    code = getattr(func, '__code__', None)
+    if code is None:
+        h.update(_stable_repr(func).encode('utf8'))
+        return
+    _hash_code(code, h)
+    for cell in getattr(func, '__closure__', None) or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:  # the cell is empty
+            continue
+        if inspect.isfunction(value):
+            _hash_function(value, h)
+        else:
+            h.update(_stable_repr(value).encode('utf8'))
+
+
+def _hash_code(code: CodeType, h: Any) -> None:
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode('utf8'))
+    for const in code.co_consts:
+        if isinstance(const, CodeType):  # lambdas, comprehensions and nested functions
+            _hash_code(const, h)
+        else:
+            h.update(_stable_repr(const).encode('utf8'))
+
+
+def _stable_repr(value: Any) -> str:
+    # repr, which doesn't depend on the process: without addresses and hash order
+    if isinstance(value, (set, frozenset)):
+        return '{' + ', '.join(sorted(map(_stable_repr, value))) + '}'
+    if isinstance(value, tuple):
+        return '(' + ', '.join(map(_stable_repr, value)) + ')'
+    return _ADDRESS.sub('', repr(value))
+
+
+_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def _encode(value: Any) -> Envelope:
+    return codec.encode(value, prefer=('ndarray', 'pickle'))
+
+
+def _decode(envelope: Envelope) -> Any:
+    return codec.decode(envelope)
+
+
+def _is_view(envelope: Envelope) -> bool:
+    # arrays and out-of-band buffers of pickle are decoded as views of the data, not as copies
+    if get_meta_attr(envelope.meta, 'codec') == 'ndarray':
+        return True
+    return len(get_meta_attr(envelope.meta, 'codec_meta', {}).get('buffers', ())) > 1
+
+
+def sizeof(value: Any, _seen: set[int] | None = None) -> int:
+    """Approximate size of the value in bytes.
+
+    Containers (lists, tuples, sets, dicts) and objects with `__dict__` are measured recursively,
+    an object referenced several times is counted once.
+    Other objects are measured by `sys.getsizeof`, i.e. without the objects they refer to.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, (np.ndarray, memoryview)):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray)):
+        return size
+    if isinstance(value, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item, _seen) for item in value)
+    elif hasattr(value, '__dict__') and not isinstance(value, type):
+        size += sizeof(vars(value), _seen)
+    return size
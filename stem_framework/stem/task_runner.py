@@ -1,79 +1,562 @@
 import os
+import sys
+import pickle
 import asyncio
+import inspect
+from collections import deque
 from concurrent import futures
-from typing import Generic, TypeVar
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+from importlib import import_module
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Generic, Hashable, Iterator, Optional, TypeVar
 from abc import ABC, abstractmethod
 
-from .meta import Meta, get_meta_attr
+import numpy as np
+
+from .meta import Meta, get_meta_attr, meta_hash
+from .task import Task, task_executor
+from .task_cache import ResultCache
+from .stream import Stream, pump
 from .task_tree import TaskNode
+from .workspace import IWorkspace, Workspace
 
 T = TypeVar("T")
 
 
+@dataclass
+class Job(Generic[T]):
+    """Computation of one node of the task tree with particular metadata"""
+    task_node: TaskNode[T]
+    meta: Meta
+    dependencies: dict[str, Hashable] = field(default_factory=dict)  # argument name -> key of the job
+    consumers: int = 0
+    cached: bool = False
+    result: Any = None
+
+
+class JobResults:
+    """Results of the jobs of one run.
+
+    A result needed by several consumers is handed to each of them.
+    An iterator can be read only once, so a shared iterator is read into a list
+    and every consumer gets its own iterator over the list.
+    """
+
+    def __init__(self, jobs: dict[Hashable, Job]):
+        self.jobs = jobs
+        self._copies: dict[Hashable, list] = {}
+        self._lock = Lock()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        n = self.jobs[key].consumers
+        if isinstance(value, Iterator) and n > 1:
+            items = list(value)
+            copies = [iter(items) for _ in range(n)]
+        else:
+            copies = [value] * n
+        with self._lock:
+            self._copies[key] = copies
+
+    def take(self, key: Hashable) -> Any:
+        with self._lock:
+            return self._copies[key].pop()
+
+    def kwargs(self, job: Job) -> dict[str, Any]:
+        return {name: self.take(key) for name, key in job.dependencies.items()}
+
+
 class TaskRunner(ABC, Generic[T]):
+    cache: ResultCache | None = None
 
     @abstractmethod
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
         pass
 
+    def _lookup(self, meta: Meta, task_node: TaskNode[T]) -> tuple[bool, Any]:
+        if self.cache is None:
+            return False, None
+        return self.cache.lookup(meta, task_node)
+
+    def _store(self, meta: Meta, task_node: TaskNode[T], result: T) -> T:
+        if self.cache is not None:
+            self.cache.store(meta, task_node, result)
+        return result
+
+    def _plan(self, meta: Meta, task_node: TaskNode[T]) -> tuple[Hashable, dict[Hashable, Job]]:
+        """Unfolds the tree into jobs, returns the key of the root job and all jobs.
+
+        Jobs are listed so that dependencies go before their consumers.
+        A node reached by several paths with the same metadata becomes one job.
+        The subtree of a node found in the cache is not unfolded.
+        """
+        jobs: dict[Hashable, Job] = {}
+
+        def visit(meta: Meta, task_node: TaskNode) -> Hashable:
+            key = id(task_node), meta_hash(meta)
+            if key not in jobs:
+                found, result = self._lookup(meta, task_node)
+                job = Job(task_node, meta, cached=found, result=result)
+                if not found:
+                    for t in task_node.dependencies:
+                        job.dependencies[t.task.name] = visit(get_meta_attr(meta, t.task.name, {}), t)
+                jobs[key] = job
+            jobs[key].consumers += 1
+            return key
+
+        return visit(meta, task_node), jobs
+
 
 class SimpleRunner(TaskRunner[T]):
+
+    def __init__(self, cache: ResultCache | None = None) -> None:
+        self.cache = cache
+
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
         assert not task_node.has_dependence_errors
-        kwargs = {
-            t.task.name: self.run(
-                get_meta_attr(meta, t.task.name, {}),
-                t
-            )
-            for t in task_node.dependencies
-        }
-        return task_node.task.transform(meta, **kwargs)
+        root, jobs = self._plan(meta, task_node)
+        results = JobResults(jobs)
+        for key, job in jobs.items():
+            if job.cached:
+                results.set(key, job.result)
+            else:
+                result = _call(job.task_node.task, job.meta, results.kwargs(job))
+                results.set(key, self._store(job.meta, job.task_node, result))
+        return results.take(root)
 
 
 class ThreadingRunner(TaskRunner[T]):
+    """Ready-queue scheduler: a job is submitted as soon as all its dependencies are computed,
+    at most MAX_WORKERS jobs are submitted at once."""
 
-    def __init__(self, MAX_WORKERS) -> None:
+    def __init__(self, MAX_WORKERS, cache: ResultCache | None = None) -> None:
         self.MAX_WORKERS = MAX_WORKERS
+        self.cache = cache
 
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
         with futures.ThreadPoolExecutor(self.MAX_WORKERS) as executor:
-            return self._run(meta, task_node, executor).result()
+            return self._run(meta, task_node, executor)
+
+    def _submit(self, executor: futures.Executor, job: Job, kwargs: dict[str, Any]) -> futures.Future:
+        # the task may submit parts of its work to the same pool (see task_executor)
+        context = copy_context()
+        context.run(task_executor.set, executor)
+        return executor.submit(context.run, _call, job.task_node.task, job.meta, kwargs)
 
     def _run(self, meta: Meta, task_node: TaskNode[T], executor: futures.Executor):
-        kwargs = {
-            t.task.name: self._run(
-                get_meta_attr(meta, t.task.name, {}),
-                t,
-                executor
-            )
-            for t in task_node.dependencies
-        }
-        futures.wait(kwargs.values())
-        kwargs = {k: v.result() for k, v in kwargs.items()}
-        return executor.submit(task_node.task.transform, meta, **kwargs)
+        assert not task_node.has_dependence_errors
+        root, jobs = self._plan(meta, task_node)
+        results = JobResults(jobs)
+
+        # in-degree of a job is the number of its dependencies which are not computed yet
+        in_degree = {key: len(set(job.dependencies.values())) for key, job in jobs.items()}
+        dependents: dict[Hashable, list[Hashable]] = {key: [] for key in jobs}
+        for key, job in jobs.items():
+            for k in set(job.dependencies.values()):
+                dependents[k].append(key)
+
+        ready = deque(key for key, n in in_degree.items() if n == 0)
+        running: dict[futures.Future, Hashable] = {}
+
+        # a result is released when all its consumers are finished
+        unfinished_consumers = {key: len(dependents[key]) for key in jobs}
+        produced: dict[Hashable, Any] = {}
+
+        def finish(key: Hashable, result: Any):
+            produced[key] = result
+            results.set(key, result)
+            for d in dependents[key]:
+                in_degree[d] -= 1
+                if in_degree[d] == 0:
+                    ready.append(d)
+            for k in set(jobs[key].dependencies.values()):
+                unfinished_consumers[k] -= 1
+                if unfinished_consumers[k] == 0:
+                    self._release(produced.pop(k))
+
+        try:
+            while ready or running:
+                while ready and len(running) < self.MAX_WORKERS:
+                    key = ready.popleft()
+                    job = jobs[key]
+                    if job.cached:
+                        finish(key, job.result)
+                    else:
+                        running[self._submit(executor, job, results.kwargs(job))] = key
+
+                if running:
+                    done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        key = running.pop(future)
+                        job = jobs[key]
+                        finish(key, self._store(job.meta, job.task_node, future.result()))
+
+            return self._fetch(results.take(root))
+        finally:
+            # after an error, the jobs which are still running are waited for and released too
+            futures.wait(running)
+            for future in running:
+                if future.exception() is None:
+                    self._release(future.result())
+            for result in produced.values():
+                self._release(result)
+
+    def _fetch(self, result: Any) -> Any:
+        """Converts the result of the root job to the value returned by `run`"""
+        return result
+
+    def _release(self, result: Any) -> None:
+        """Called when all consumers of the result are finished"""
 
 
 class ProcessingRunner(ThreadingRunner[T]):
+    """Runs tasks in a pool of processes.
 
-    def __init__(self) -> None:
-        self.MAX_WORKERS = os.cpu_count()
+    Bound methods of decorator-created tasks cannot be pickled,
+    so a task is sent to a worker as a `TaskReference` and is imported there.
+    A task which has no reference is pickled, and if it cannot be pickled either,
+    it is run in the main process.
+    Iterators cannot cross the boundary of a process, so they are read into lists.
+
+    NumPy arrays larger than `shared_memory_threshold` bytes are not pickled,
+    they are put into shared memory and consumers get views of it without copying.
+    The shared memory of a result is freed when all consumers of the result are finished.
+    """
+
+    def __init__(self, MAX_WORKERS: int | None = None, *, cache: ResultCache | None = None,
+                 shared_memory_threshold: int | None = 1024*1024):
+        if isinstance(MAX_WORKERS, ResultCache):
+            # ProcessingRunner(cache) was the signature before MAX_WORKERS was added
+            raise TypeError('the cache of ProcessingRunner is a keyword argument: ProcessingRunner(cache=...)')
+        self.MAX_WORKERS = MAX_WORKERS if MAX_WORKERS is not None else os.cpu_count()
+        self.cache = cache
+        self.shared_memory_threshold = shared_memory_threshold
 
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        resource_tracker.ensure_running()  # workers will share the tracker of this process
         with futures.ProcessPoolExecutor(self.MAX_WORKERS) as executor:
-            return self._run(meta, task_node, executor).result()
+            return self._run(meta, task_node, executor)
+
+    def _submit(self, executor: futures.Executor, job: Job, kwargs: dict[str, Any]) -> futures.Future:
+        kwargs = {k: materialize(v) for k, v in kwargs.items()}
+        threshold = self.shared_memory_threshold
+
+        if (reference := TaskReference.of(job.task_node)) is not None:
+            return executor.submit(_transform_by_reference, reference, job.meta, kwargs, threshold)
+        elif _is_picklable(job.task_node.task):
+            return executor.submit(_transform, job.task_node.task, job.meta, kwargs, threshold)
+
+        future: futures.Future = futures.Future()
+        try:
+            future.set_result(_transform(job.task_node.task, job.meta, kwargs, threshold))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _store(self, meta: Meta, task_node: TaskNode[T], result: T) -> T:
+        if self.cache is not None and isinstance(result, SharedArray):
+            self.cache.store(meta, task_node, result.read())
+            return result
+        return super()._store(meta, task_node, result)
+
+    def _fetch(self, result: Any) -> Any:
+        if isinstance(result, SharedArray):
+            return result.read()
+        return result
+
+    def _release(self, result: Any) -> None:
+        if isinstance(result, SharedArray):
+            result.unlink()
 
 
 class AsyncRunner(TaskRunner[T]):
+    """Runs the jobs in one event loop.
+
+    Async tasks (e.g. `@task` on `async def`) are awaited in the loop.
+    Sync tasks would block the loop, so they are offloaded to `executor`,
+    None means the default executor of the loop, i.e. a pool of threads.
+    If `executor` is a ProcessPoolExecutor, tasks are sent to it by `TaskReference`,
+    and tasks which have no reference are run in the pool of threads.
+    """
+
+    def __init__(self, cache: ResultCache | None = None, executor: futures.Executor | None = None) -> None:
+        self.cache = cache
+        self.executor = executor
+
     def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
-        return asyncio.run(self._run(meta, task_node))
+        assert not task_node.has_dependence_errors
+        root, jobs = self._plan(meta, task_node)
+        results = JobResults(jobs)
+        asyncio.run(self._run(jobs, results))
+        return results.take(root)
 
-    async def _run(self, meta: Meta, task_node: TaskNode[T]):
+    async def _run(self, jobs: dict[Hashable, Job], results: JobResults):
+        tasks: dict[Hashable, asyncio.Task] = {}
         async with asyncio.TaskGroup() as tg:
-            kwargs = {
-                t.task.name: tg.create_task(
-                    self._run(get_meta_attr(meta, t.task.name, {}), t)
+            for key, job in jobs.items():
+                tasks[key] = tg.create_task(
+                    self._run_job(key, job, [tasks[k] for k in job.dependencies.values()], results)
                 )
-                for t in task_node.dependencies
-            }
-        kwargs = {k: v.result() for k, v in kwargs.items()}
-        return task_node.task.transform(meta, **kwargs)
\ No newline at end of file
+
+    async def _run_job(self, key: Hashable, job: Job, dependencies: list[asyncio.Task], results: JobResults):
+        if job.cached:
+            results.set(key, job.result)
+            return
+        for dependence in dependencies:
+            await dependence
+
+        task = job.task_node.task
+        kwargs = results.kwargs(job)
+        if task.is_async:
+            result = await task.transform(job.meta, **kwargs)
+        else:
+            result = await self._offload(job, kwargs)
+        results.set(key, self._store(job.meta, job.task_node, result))
+
+    async def _offload(self, job: Job, kwargs: dict[str, Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        if isinstance(self.executor, futures.ProcessPoolExecutor):
+            if (reference := TaskReference.of(job.task_node)) is not None:
+                kwargs = {k: materialize(v) for k, v in kwargs.items()}
+                return await loop.run_in_executor(self.executor, _transform_by_reference, reference, job.meta, kwargs)
+            executor = None
+        else:
+            executor = self.executor
+        return await loop.run_in_executor(executor, _call, job.task_node.task, job.meta, kwargs)
+
+
+class StreamingRunner(TaskRunner[T]):
+    """Runs all jobs of a pipeline at once, each in its own thread.
+
+    A result which is an iterator is sent to each consumer through a `Stream`
+    in chunks of `chunk_size` items, at most `max_chunks` chunks are buffered.
+    So the stages of a pipeline such as `int_range -> int_scale -> int_reduce` overlap
+    and memory does not depend on the length of the pipeline's input.
+
+    An iterator read by several consumers goes to them through unbounded streams:
+    if the consumers meet downstream (e.g. `both(src, doubled)` where `doubled` reads `src`),
+    one of them may wait for the other, and bounded queues would deadlock.
+
+    All stages must run at once, so a pipeline of more than `max_workers` jobs is rejected.
+    The iterator returned by the root job is returned to the caller wrapped,
+    the threads are joined when it is exhausted or closed.
+    """
+
+    def __init__(self, chunk_size: int = 1024, max_chunks: int = 4, *, cache: ResultCache | None = None,
+                 max_workers: int = 64):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.cache = cache
+        self.max_workers = max_workers
+
+    def run(self, meta: Meta, task_node: TaskNode[T]) -> T:
+        assert not task_node.has_dependence_errors
+        root, jobs = self._plan(meta, task_node)
+        if len(jobs) > self.max_workers:
+            raise ValueError(f'the pipeline has {len(jobs)} stages, but max_workers = {self.max_workers}')
+
+        # a job publishes the list of copies of its result, one copy per consumer
+        outputs: dict[Hashable, futures.Future] = {key: futures.Future() for key in jobs}
+        all_streams: list[Stream] = []
+        lock = Lock()
+
+        def take(key: Hashable) -> Any:
+            copies = outputs[key].result()
+            with lock:
+                return copies.pop()
+
+        def run_job(key: Hashable, job: Job):
+            inputs: list[Stream] = []
+            try:
+                if job.cached:
+                    result = job.result
+                else:
+                    kwargs = {name: take(k) for name, k in job.dependencies.items()}
+                    inputs = [v for v in kwargs.values() if isinstance(v, Stream)]
+                    result = self._store(job.meta, job.task_node, _call(job.task_node.task, job.meta, kwargs))
+
+                if isinstance(result, Iterator) and key != root:
+                    max_chunks = self.max_chunks if job.consumers == 1 else 0
+                    streams = [Stream(max_chunks) for _ in range(job.consumers)]
+                    with lock:
+                        all_streams.extend(streams)
+                    outputs[key].set_result(list(streams))  # consumers pop their streams from the copy
+                    pump(result, streams, self.chunk_size)
+                else:
+                    outputs[key].set_result([result] * job.consumers)
+
+                if not isinstance(result, Iterator) or key != root:
+                    # the result is computed, so unread items of the inputs are not needed,
+                    # but a lazy iterator returned to the caller still reads its inputs
+                    for s in inputs:
+                        s.close()
+            except BaseException as e:
+                for s in inputs:
+                    s.close()
+                if not outputs[key].done():
+                    outputs[key].set_exception(e)
+
+        # Потоки демонические, чтобы зависший конвейер не мешал завершению интерпретатора,
+        # но при нормальной работе они всегда дожидаются в shutdown
+        threads = [Thread(target=run_job, args=(key, job), name=f'stem-stream-{i}', daemon=True)
+                   for i, (key, job) in enumerate(jobs.items())]
+
+        def shutdown():
+            with lock:
+                streams = list(all_streams)
+            for s in streams:
+                s.close()
+            for thread in threads:
+                thread.join()
+
+        try:
+            for thread in threads:
+                thread.start()
+            result = take(root)
+        except BaseException:
+            shutdown()
+            raise
+
+        if isinstance(result, Iterator):
+            return _closing(result, shutdown)  # type: ignore
+        shutdown()
+        return result
+
+
+def _closing(iterator: Iterator, shutdown: Callable[[], None]) -> Iterator:
+    try:
+        yield from iterator
+    finally:
+        shutdown()
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Descriptor of a NumPy array in shared memory.
+    It is sent between processes instead of the array itself."""
+    name: str
+    dtype: str
+    shape: tuple[int, ...]
+
+    @staticmethod
+    def share(array: np.ndarray) -> "SharedArray":
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        # The segment is owned by the main process, which unlinks it.
+        # Otherwise the resource tracker would unlink it when this worker exits.
+        resource_tracker.unregister(shm._name, 'shared_memory')  # type: ignore
+        shm.close()
+        return SharedArray(shm.name, array.dtype.str, array.shape)
+
+    def attach(self) -> tuple[SharedMemory, np.ndarray]:
+        shm = SharedMemory(self.name)
+        resource_tracker.unregister(shm._name, 'shared_memory')  # type: ignore
+        return shm, np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+
+    def read(self) -> np.ndarray:
+        shm, view = self.attach()
+        array = view.copy()
+        del view
+        shm.close()
+        return array
+
+    def unlink(self) -> None:
+        shm = SharedMemory(self.name)
+        shm.close()
+        shm.unlink()
+
+
+@dataclass(frozen=True)
+class TaskReference:
+    """Picklable reference to a task: the module and the path of the task in the workspace of the module"""
+    module: str
+    task_path: str
+
+    def resolve(self) -> Task:
+        workspace = IWorkspace.module_workspace(import_module(self.module))
+        task = workspace.find_task(self.task_path)
+        if task is None:
+            raise LookupError(f"task '{self.task_path}' was not found in module '{self.module}'")
+        return task
+
+    @staticmethod
+    def of(task_node: TaskNode) -> Optional["TaskReference"]:
+        workspace = task_node._workspace
+        if isinstance(workspace, Workspace):
+            module_name = workspace.__module__
+        else:
+            module_name = workspace.name    # module workspace is named after the module
+
+        if (module := sys.modules.get(module_name)) is None:
+            return None
+        task_path = IWorkspace.module_workspace(module).find_task_path(task_node.task)
+        if task_path is None:
+            return None
+
+        reference = TaskReference(module_name, str(task_path))
+        try:
+            if reference.resolve() is task_node.task:
+                return reference
+        except LookupError:
+            pass
+        return None
+
+
+def _call(task: Task, meta: Meta, kwargs: dict[str, Any]) -> Any:
+    result = task.transform(meta, **kwargs)
+    if inspect.iscoroutine(result):
+        # async task in a sync runner
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(result)
+        result.close()
+        raise RuntimeError(f'async task {task.name} is run by a sync runner inside a running event loop, '
+                           f'use AsyncRunner instead')
+    return result
+
+
+def materialize(value: Any) -> Any:
+    if isinstance(value, Iterator):
+        return list(value)
+    return value
+
+
+def _transform(task: Task, meta: Meta, kwargs: dict[str, Any], shared_memory_threshold: int | None = None) -> Any:
+    kwargs = dict(kwargs)
+    handles = []
+    for name, value in kwargs.items():
+        if isinstance(value, SharedArray):
+            shm, kwargs[name] = value.attach()
+            handles.append(shm)
+
+    result = materialize(_call(task, meta, kwargs))
+
+    if isinstance(result, np.ndarray) and not result.dtype.hasobject:
+        if shared_memory_threshold is not None and result.nbytes >= shared_memory_threshold:
+            result = SharedArray.share(result)
+        elif any(isinstance(v, np.ndarray) and np.shares_memory(result, v) for v in kwargs.values()):
+            result = result.copy()  # a view of the input must not outlive the shared memory
+
+    del kwargs
+    for shm in handles:
+        try:
+            shm.close()
+        except BufferError:
+            pass    # the task has kept a view of its input somewhere, the memory is unmapped by gc
+    return result
+
+
+def _transform_by_reference(reference: TaskReference, meta: Meta, kwargs: dict[str, Any],
+                            shared_memory_threshold: int | None = None) -> Any:
+    return _transform(reference.resolve(), meta, kwargs, shared_memory_threshold)
+
+
+def _is_picklable(obj: Any) -> bool:
+    try:
+        pickle.dumps(obj)
+        return True
+    except Exception:
+        return False
@@ -1,3 +1,4 @@
+from functools import cached_property
 from typing import Type, TypeVar, Optional, Generic
 
 from .task import Task
@@ -24,34 +25,58 @@ class TaskNode(Generic[T]):
     def has_dependence_errors(self) -> bool:
         return self._has_dependence_errors
 
-    def __init__(self, task: Task, workspace: IWorkspace | Type[IWorkspace] | None = None):
+    def __init__(self, task: Task, workspace: IWorkspace | Type[IWorkspace] | None = None,
+                 _interned: dict[Task, "TaskNode"] | None = None):
         if workspace is not None:
             workspace_ = workspace
         else:
             workspace_ = IWorkspace.find_default_workspace(task)
 
+        # Узлы интернируются: если несколько задач зависят от одной и той же задачи,
+        # то у них будет общий узел, т.е. дерево на самом деле является DAG
+        if _interned is None:
+            _interned = {}
+        _interned[task] = self
 
         self.task = task
         self._dependencies = []
         self._unresolved_dependencies = []
         self.workspace = workspace
+        self._workspace = workspace_
 
         for d in task.dependencies: # d: Task | str
             if isinstance(d, Task):
-                self._dependencies.append(TaskNode(d, workspace))
+                self._dependencies.append(TaskNode._intern(d, workspace, _interned))
             elif (t := workspace_.find_task(d)) is not None:
-                self._dependencies.append(TaskNode(t, workspace))
+                self._dependencies.append(TaskNode._intern(t, workspace, _interned))
             else:
                 self._unresolved_dependencies.append(d)
 
         self._has_dependence_errors = self._unresolved_dependencies != [] or any(d._has_dependence_errors for d in self.dependencies)
 
-    def find_node(self, task: Task[T]) -> Optional["TaskNode[T]"]:
+    @staticmethod
+    def _intern(task: Task, workspace: IWorkspace | Type[IWorkspace] | None, interned: dict[Task, "TaskNode"]) -> "TaskNode":
+        if (node := interned.get(task)) is not None:
+            return node
+        return TaskNode(task, workspace, interned)
+
+    @cached_property
+    def task_path(self) -> str:
+        """Full path of the task: name of the workspace + path of the task inside it"""
+        path = self._workspace.find_task_path(self.task)
+        return f'{self._workspace.name}.{path if path is not None else self.task.name}'
+
+    def find_node(self, task: Task[T], _visited: set[int] | None = None) -> Optional["TaskNode[T]"]:
         if self.task == task:
             return self
+        if _visited is None:
+            _visited = set()
         for d in self.dependencies:
-            if (node := d.resolve_node(task)) is not None:
-                return node
+            if id(d) not in _visited:   # shared nodes are searched once
+                _visited.add(id(d))
+                if (node := d.find_node(task, _visited)) is not None:
+                    return node
+        return None
 
     def resolve_node(self, task: Task[T], workspace: IWorkspace | Type[IWorkspace] | None = None) -> "TaskNode[T]":
         """«Кешированная» версия TaskNode.__init__
@@ -50,6 +50,10 @@ class ProxyTask(Task[T]):
     def specification(self):
         return self._task.specification
 
+    @property
+    def is_async(self):
+        return self._task.is_async
+
     def check_by_meta(self, meta: Meta):
         self._task.check_by_meta(meta)
 
@@ -83,6 +87,17 @@ class IWorkspace:
                     return t
             return None
 
+    @classmethod
+    def find_task_path(cls, task: Task) -> Optional[TaskPath]:
+        """Inverse of `find_task`: the path under which the task is registered in the workspace"""
+        for task_name, t in cls.tasks.items():
+            if t is task:
+                return TaskPath(task_name)
+        for w in cls.workspaces:
+            if (path := w.find_task_path(task)) is not None:
+                return TaskPath([w.name, *path._path])
+        return None
+
     @classmethod
     def has_task(cls, task_path: Union[str, TaskPath]) -> bool:
         return cls.find_task(task_path) is not None
@@ -125,7 +140,8 @@ class IWorkspace:
                 if isinstance(t, Task):
                     tasks[s] = t
                 if isinstance(t, IWorkspace) or isinstance(t, type) and issubclass(t, IWorkspace):
-                    workspaces.add(t)
+                    if t.tasks is not NotImplemented:   # skip imported IWorkspace and Workspace themselves
+                        workspaces.add(t)
 
             module.__stem_workspace = create_workspace(  # type: ignore
                 module.__name__, tasks, workspaces
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from stem.envelope import Envelope
+from stem.meta import get_meta_attr
+from stem.remote.connection import ConnectionPool
+from stem.remote.unit import start_unit_in_subprocess
+from tests.example_workspace import IntWorkspace
+
+HOST = "localhost"
+PORT = 9920
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self) -> None:
+        self.process, self.server = start_unit_in_subprocess(IntWorkspace, HOST, PORT, 7)
+        self.pool = ConnectionPool(HOST, PORT, max_connections=2)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.process.join()
+
+    def _powerfullity(self) -> int:
+        response = self.pool.request(Envelope({'command': 'powerfullity'}), timeout=10)
+        self.assertIsNotNone(get_meta_attr(response.meta, 'request_id'))
+        return get_meta_attr(response.meta, 'powerfullity')
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertEqual(self._powerfullity(), 7)
+        self.assertEqual(len(self.pool._connections), 1)
+
+    def test_concurrent_requests(self):
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: self._powerfullity(), range(40)))
+        self.assertEqual(results, [7] * 40)
+        self.assertLessEqual(len(self.pool._connections), 2)
+
+    def test_reconnect(self):
+        self.assertEqual(self._powerfullity(), 7)
+        # the unit is restarted, the open connection is broken
+        self.server.shutdown()
+        self.server.server_close()
+        self.process.join()
+        self.process, self.server = start_unit_in_subprocess(IntWorkspace, HOST, PORT, 8)
+        self.assertEqual(self._powerfullity(), 8)
@@ -1,6 +1,8 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 
-from stem.remote.remote_workspace import RemoteTask, RemoteWorkspace
+from stem.meta import get_meta_attr
+from stem.remote.connection import ConnectionPool
+from stem.remote.remote_workspace import RemoteTask, RemoteWorkspace, _structure_cache
 from stem.remote.unit import start_unit_in_subprocess
 
 from tests.example_workspace import IntWorkspace
@@ -45,4 +47,38 @@ class TestRemoteWorkspace(TestCase):
 
         subtasks = subworkspace.tasks
         logging.info(subtasks.keys())
-        self.assertTrue('SubWorkspace.int_reduce' in subtasks)
\ No newline at end of file
+        self.assertTrue('SubWorkspace.int_reduce' in subtasks)
+
+
+class TestStructureCache(TestCase):
+    def setUp(self) -> None:
+        _structure_cache.clear()
+        self.process, self.server = start_unit_in_subprocess(IntWorkspace, HOST, PORT)
+        self.workspace = RemoteWorkspace(HOST, PORT)
+
+    def tearDown(self) -> None:
+        _structure_cache.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.process.join()
+
+    def test_cached(self):
+        responses = []
+        original = ConnectionPool.request
+
+        def request(pool, envelope, timeout=None):
+            responses.append(original(pool, envelope, timeout))
+            return responses[-1]
+
+        with mock.patch.object(ConnectionPool, 'request', request):
+            self.workspace.name, self.workspace.tasks, self.workspace.workspaces
+            self.assertIs(self.workspace.tasks, self.workspace.tasks)
+            self.assertIsInstance(self.workspace.find_task('SubWorkspace.int_reduce'), RemoteTask)
+            self.assertIsInstance(self.workspace.find_task('int_reduce'), RemoteTask)
+            self.assertIsNone(self.workspace.find_task('no_such_task'))
+            self.assertEqual(len(responses), 1)
+
+            # after the ttl the structure is revalidated, but not sent again
+            with mock.patch.object(RemoteWorkspace, 'ttl', 0):
+                self.workspace.tasks
+            self.assertEqual([get_meta_attr(r.meta, 'status') for r in responses], ['fulfilled', 'not_modified'])
@@ -0,0 +1,51 @@
+from unittest import TestCase, skipUnless
+
+import numpy as np
+
+from stem import codec
+from stem.envelope import Envelope
+
+
+class CodecTest(TestCase):
+
+    def _round_trip(self, value, prefer=codec.DEFAULT_CODECS):
+        envelope = codec.encode(value, {'status': 'fulfilled'}, prefer)
+        received = Envelope.from_bytes(envelope.to_bytes())
+        self.assertEqual(received.meta['status'], 'fulfilled')
+        return received, codec.decode(received)
+
+    def test_json(self):
+        received, value = self._round_trip({'a': [1, 2]})
+        self.assertEqual(received.meta['codec'], 'json')
+        self.assertEqual(value, {'a': [1, 2]})
+
+    def test_ndarray(self):
+        array = np.arange(12, dtype='<f4').reshape(3, 4)
+        received, value = self._round_trip(array)
+        self.assertEqual(received.meta['codec'], 'ndarray')
+        np.testing.assert_equal(value, array)
+        self.assertEqual(received.data_length, array.nbytes)  # raw bytes only
+        self.assertTrue(np.shares_memory(value, np.frombuffer(received.data, 'u1')))
+
+    def test_pickle_out_of_band(self):
+        array = np.arange(1000, dtype='f8')
+        received, value = self._round_trip({'x': array, 'name': {1, 2}})
+        self.assertEqual(received.meta['codec'], 'pickle')
+        self.assertEqual(value['name'], {1, 2})
+        np.testing.assert_equal(value['x'], array)
+        # the array is a view of the data section, not an unpickled copy
+        self.assertTrue(np.shares_memory(value['x'], np.frombuffer(received.data, 'u1')))
+
+    @skipUnless(codec.msgpack is not None, 'msgpack is not installed')
+    def test_msgpack(self):
+        _, value = self._round_trip([1, 'a', {'b': 2.5}], 'msgpack')
+        self.assertEqual(value, [1, 'a', {'b': 2.5}])
+
+    def test_envelope_without_codec(self):
+        self.assertEqual(codec.decode(Envelope({'status': 'fulfilled'}, b'[1, 2]')), [1, 2])
+
+    def test_errors(self):
+        with self.assertRaises(codec.CodecError):
+            codec.encode(lambda x: x, prefer=('ndarray', 'json'))
+        with self.assertRaises(codec.CodecError):
+            codec.decode(Envelope({'codec': 'unknown'}))
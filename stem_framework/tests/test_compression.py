@@ -0,0 +1,48 @@
+from unittest import TestCase, mock
+
+import numpy as np
+
+from stem import codec, compression
+from stem.envelope import Envelope
+
+
+class CompressionTest(TestCase):
+
+    def setUp(self) -> None:
+        self.data = b'telemetry 0123456789 ' * 10_000
+        self.envelope = Envelope({'status': 'fulfilled'}, self.data)
+
+    def test_round_trip(self):
+        for method in compression.accepted():
+            with self.subTest(method=method):
+                compressed = compression.compress(self.envelope, method)
+                self.assertEqual(compressed.meta['compression'], method)
+                self.assertLess(compressed.data_length, len(self.data))
+
+                received = Envelope.from_bytes(compressed.to_bytes())
+                restored = compression.decompress(received)
+                self.assertEqual(restored.meta, {'status': 'fulfilled'})
+                self.assertEqual(restored.data, self.data)
+
+    def test_threshold(self):
+        small = Envelope({}, b'abc' * 10)
+        self.assertIs(compression.compress(small, 'zlib'), small)
+        self.assertIs(compression.compress(self.envelope, None), self.envelope)
+
+    def test_large_data(self):
+        # both compressed and decompressed data go through temporary files
+        with mock.patch.object(Envelope, '_MAX_SIZE', 100), mock.patch.object(Envelope, '_CHUNK_SIZE', 4096):
+            compressed = compression.compress(self.envelope, 'zlib')
+            self.assertIsNotNone(compressed.tmp_file)
+            restored = compression.decompress(Envelope.from_bytes(compressed.to_bytes()))
+            self.assertEqual(bytes(restored.data), self.data)
+
+    def test_negotiate(self):
+        self.assertEqual(compression.negotiate({'accept_compression': ['brotli', 'zlib']}), 'zlib')
+        self.assertIsNone(compression.negotiate({'accept_compression': ['brotli']}))
+        self.assertIsNone(compression.negotiate({}))
+
+    def test_codec(self):
+        array = np.zeros(100_000)
+        compressed = compression.compress(codec.encode(array), 'lzma')
+        np.testing.assert_equal(codec.decode(Envelope.from_bytes(compressed.to_bytes())), array)
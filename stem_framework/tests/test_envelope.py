@@ -1,5 +1,9 @@
+import asyncio
 import io
-from unittest import TestCase
+import socket
+import tempfile
+from threading import Thread
+from unittest import TestCase, mock
 
 from stem.envelope import Envelope
 
@@ -15,3 +19,97 @@ class TestEnvelope(TestCase):
         envelope = Envelope.from_bytes(data)
         self.assertDictEqual(self.envelope.meta, envelope.meta)
         self.assertEqual(self.envelope.data, envelope.data)
+
+    def test_from_buffer(self):
+        data = self.envelope.to_bytes()
+        envelope = Envelope.from_buffer(data)
+        self.assertDictEqual(self.envelope.meta, envelope.meta)
+        self.assertIsInstance(envelope.data, memoryview)
+        self.assertEqual(self.envelope.data, envelope.data)
+
+    def test_iterator_data(self):
+        chunks = [b'01234', b'56789']
+        envelope = Envelope(dict(a=1), iter(chunks), data_length=10)
+        self.assertEqual(Envelope.from_bytes(envelope.to_bytes()).data, self.data)
+
+    def test_file_data(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b'xx' + self.data)
+            file.seek(2)
+            with mock.patch.object(Envelope, '_CHUNK_SIZE', 3):
+                data = Envelope(dict(a=1), file).to_bytes()
+        self.assertEqual(Envelope.from_bytes(data).data, self.data)
+
+    def test_read_stream(self):
+        stream = io.BytesIO(self.envelope.to_bytes() + Envelope({'next': True}).to_bytes())
+        envelope = Envelope.read_stream(stream, chunk_size=4)
+        self.assertEqual(envelope.data_length, 10)
+        self.assertEqual(list(envelope.data), [b'0123', b'4567', b'89'])
+        self.assertEqual(Envelope.read(stream).meta, {'next': True})
+
+    def test_truncated(self):
+        with self.assertRaises(EOFError):
+            Envelope.from_bytes(self.envelope.to_bytes()[:-1])
+
+    def test_large_data(self):
+        # large data is mmapped from the file, the offset of the data isn't aligned
+        with mock.patch.object(Envelope, '_MAX_SIZE', 5), tempfile.TemporaryFile() as file:
+            self.envelope.write_to(file)
+            Envelope({'next': True}).write_to(file)
+            file.seek(0)
+            envelope = Envelope.read(file)
+            self.assertEqual(bytes(envelope.data), self.data)
+            self.assertEqual(Envelope.read(file).meta, {'next': True})
+
+            # a stream without random access goes through a temporary file
+            envelope = Envelope.read(io.BufferedReader(io.BytesIO(self.envelope.to_bytes())))
+            self.assertIsNotNone(envelope.tmp_file)
+            self.assertEqual(bytes(envelope.data), self.data)
+
+    def test_async(self):
+        async def round_trip():
+            reader = asyncio.StreamReader()
+            reader.feed_data(self.envelope.to_bytes())
+            reader.feed_eof()
+            envelope = await Envelope.async_read(reader)
+
+            written = []
+            writer = mock.Mock(write=written.append, drain=mock.AsyncMock())
+            await envelope.async_write_to(writer)
+            return envelope, b''.join(written)
+
+        envelope, data = asyncio.run(round_trip())
+        self.assertEqual(envelope.data, self.data)
+        self.assertEqual(data, self.envelope.to_bytes())
+
+    def _send_and_recv(self, envelope: Envelope) -> Envelope:
+        # the receiver runs concurrently, large data doesn't fit into the socket buffers
+        received = []
+        left, right = socket.socketpair()
+        with left, right:
+            thread = Thread(target=lambda: received.append(Envelope.recv(right)))
+            thread.start()
+            envelope.send(left)
+            thread.join(10)
+        return received[0]
+
+    def test_send_recv(self):
+        self.assertEqual(self._send_and_recv(self.envelope).data, self.data)
+
+        data = bytes(range(256)) * 10_000
+        with tempfile.TemporaryFile() as file:
+            file.write(b'xx' + data)
+            file.seek(2)
+            with mock.patch.object(socket.socket, 'sendfile', autospec=True, side_effect=socket.socket.sendfile) as sendfile:
+                self.assertEqual(self._send_and_recv(Envelope({'a': 1}, file)).data, data)
+            sendfile.assert_called_once()
+            self.assertEqual(file.tell(), 2)
+
+    def test_send_mapped_data(self):
+        data = bytes(range(256)) * 100
+        with mock.patch.object(Envelope, '_MAX_SIZE', 5), tempfile.TemporaryFile() as file:
+            Envelope({'a': 1}, data).write_to(file)
+            file.seek(0)
+            envelope = Envelope.read(file)
+            received = self._send_and_recv(envelope)
+        self.assertEqual(bytes(received.data), data)
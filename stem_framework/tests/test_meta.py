@@ -1,7 +1,7 @@
 import dataclasses
 from unittest import TestCase
 
-from stem.meta import MetaVerification, update_meta, get_meta_attr
+from stem.meta import MetaVerification, update_meta, get_meta_attr, meta_hash
 
 @dataclasses.dataclass
 class Example:
@@ -89,3 +89,12 @@ class CoreTest(TestCase):
 
         verification = MetaVerification.verify(meta_nested, wrong_specification)
         self.assertFalse(verification.checked_success)
+
+    def test_meta_hash(self):
+        self.assertEqual(meta_hash({'a': 0, 'b': 0.0, 'c': []}), meta_hash(Example()))
+        self.assertEqual(meta_hash({'x': 1, 'y': {'z': 2}}), meta_hash({'y': {'z': 2}, 'x': 1}))
+        self.assertNotEqual(meta_hash({'x': 1}), meta_hash({'x': 2}))
+
+        example = Example()
+        update_meta(example, d='D')
+        self.assertNotEqual(meta_hash(example), meta_hash(Example()))
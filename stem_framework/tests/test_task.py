@@ -1,8 +1,11 @@
+import asyncio
 from functools import reduce
 from unittest import TestCase
 
-from stem.task import Task, MapTask, FilterTask, ReduceTask
-from tests.example_task import IntRange, int_range, int_scale, data_scale
+import numpy as np
+
+from stem.task import Task, MapTask, FilterTask, ReduceTask, data, task
+from tests.example_task import IntRange, int_range, int_scale, data_scale, float_range
 
 
 class TaskTest(TestCase):
@@ -45,4 +48,61 @@ class TaskTest(TestCase):
         self.assertEqual(reduce(lambda acc, x: acc + x, range(0, 10, 1)),
                          task.transform({}, int_range=int_range.data({})))
 
+    def test_batched_tasks(self):
+        scale = MapTask(lambda x: x * 10, int_range, chunk_size=3)
+        result = scale.transform({}, int_range=int_range.data({}))
+        self.assertEqual(list(result), list(range(0, 100, 10)))
+
+        # chunks go from one batched task to another as they are
+        result = scale.transform({}, int_range=int_range.data({}))
+        even = FilterTask(lambda x: x % 20 == 0, scale, chunk_size=3)
+        chunks = list(even.transform({}, map_int_range=result).chunks())
+        self.assertTrue(all(isinstance(c, np.ndarray) for c in chunks))
+        self.assertEqual(np.concatenate(chunks).tolist(), list(range(0, 100, 20)))
+
+        total = ReduceTask(np.add, int_range, chunk_size=4)
+        self.assertEqual(total.transform({}, int_range=int_range.data({})), sum(range(10)))
+        largest = ReduceTask(np.maximum, float_range, chunk_size=4)
+        self.assertAlmostEqual(largest.transform({}, float_range=float_range.data({})), 0.9, places=5)
+        # not a ufunc
+        self.assertEqual(ReduceTask(max, int_range, chunk_size=4).transform({}, int_range=int_range.data({})), 9)
+
+    def test_parallel_reduce(self):
+        total = ReduceTask(np.add, int_range, chunk_size=3, parallel=True)
+        self.assertEqual(total.transform({}, int_range=iter(range(1000))), sum(range(1000)))
+
+        # associative, but not commutative: the order of the items is kept
+        concat = ReduceTask(lambda a, b: a + b, int_range, chunk_size=3, parallel=True)
+        self.assertEqual(concat.transform({}, int_range=map(str, range(20))), ''.join(map(str, range(20))))
+
+        def count(acc, x):
+            acc[x % 2] += 1
+            return acc
+
+        def merge(a, b):
+            return [a[0] + b[0], a[1] + b[1]]
+
+        parity = ReduceTask(count, int_range, chunk_size=4, identity=[0, 0], combine=merge, parallel=True)
+        self.assertEqual(parity.transform({}, int_range=iter(range(11))), [6, 5])
+        self.assertEqual(parity.transform({}, int_range=iter(())), [0, 0])
+        self.assertEqual(parity.identity, [0, 0])
+
+        with self.assertRaises(TypeError):
+            concat.transform({}, int_range=iter(()))
+
+    def test_async_decorators(self):
+
+        @data
+        async def async_source(meta):
+            return 1
+
+        @task
+        async def async_task(meta, async_source):
+            return async_source
 
+        self.assertTrue(async_source.is_async)
+        self.assertTrue(async_task.is_async)
+        self.assertEqual(async_task.dependencies, ('async_source',))
+        self.assertFalse(int_range.is_async)
+        self.assertFalse(int_scale.is_async)
+        self.assertEqual(asyncio.run(async_task.transform({}, async_source=5)), 5)
@@ -0,0 +1,193 @@
+import os
+import subprocess
+import sys
+import tempfile
+from threading import Lock
+from unittest import TestCase, mock
+
+import numpy as np
+
+from stem import task_cache
+from stem.task import MapTask, data, task
+from stem.task_cache import LRUCache, DiskCache, TieredCache, content_key, sizeof
+from stem.task_master import TaskMaster
+from stem.task_runner import SimpleRunner, ThreadingRunner, AsyncRunner, ProcessingRunner, TaskRunner
+from stem.task_tree import TaskNode
+from tests.example_task import int_reduce, data_scale, int_range
+
+
+calls = []
+
+@data
+def counted_scale(meta) -> int:
+    calls.append(meta)
+    return 10
+
+@task
+def counted_product(meta, counted_scale: int) -> int:
+    return 2 * counted_scale
+
+
+@task
+def nested_code(meta, counted_scale: int) -> int:
+    # a nested code object and a frozenset constant
+    return sum(y for y in range(counted_scale) if str(y) not in {'a', 'b', 'c'})
+
+
+class LRUCacheTest(TestCase):
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(len(cache), 2)
+
+    def test_size_eviction(self):
+        cache = LRUCache(max_entries=None, max_size=150)
+        cache.put('a', b'x' * 50)
+        cache.put('b', b'y' * 50)
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(cache.get('a')[0])
+        cache.put('c', b'z' * 1000)  # larger than the whole cache
+        self.assertFalse(cache.get('c')[0])
+
+    def test_sizeof(self):
+        array = np.zeros(1000)
+        self.assertGreater(sizeof([array, array]), array.nbytes)
+        self.assertLess(sizeof([array, array]), 2 * array.nbytes)  # the same array is counted once
+        self.assertGreater(sizeof({'a': array}), array.nbytes)
+        self.assertGreater(sizeof(['x' * 1000]), 1000)
+
+    def test_key(self):
+        cache = LRUCache()
+        node = TaskNode(data_scale)
+        self.assertEqual(cache.key({'a': 1, 'b': 2}, node), cache.key({'b': 2, 'a': 1}, node))
+        self.assertNotEqual(cache.key({'a': 1}, node), cache.key({'a': 2}, node))
+        self.assertNotEqual(cache.key({}, node), cache.key({}, TaskNode(int_reduce)))
+
+    def test_iterators_are_not_cached(self):
+        cache = LRUCache()
+        node = TaskNode(int_range)
+        cache.store({}, node, int_range.data({}))
+        self.assertEqual(len(cache), 0)
+
+
+class RunnerCacheTest(TestCase):
+
+    def _run(self, runner: TaskRunner):
+        calls.clear()
+        master = TaskMaster(runner)
+        for _ in range(3):
+            self.assertEqual(master.execute({}, counted_product).data, 20)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(runner.cache.hits, 2)
+        self.assertEqual(runner.cache.misses, 2)
+
+        master.execute({'counted_scale': {'x': 1}}, counted_product).data
+        self.assertEqual(len(calls), 2)
+
+    def test_simple(self):
+        self._run(SimpleRunner(LRUCache()))
+
+    def test_threading(self):
+        self._run(ThreadingRunner(2, LRUCache()))
+
+    def test_async(self):
+        self._run(AsyncRunner(LRUCache()))
+
+    def test_processing(self):
+        # tasks run in the workers, so only the cache statistics are seen here
+        runner = ProcessingRunner(2, cache=LRUCache())
+        for _ in range(2):
+            self.assertEqual(TaskMaster(runner).execute({}, counted_product).data, 20)
+        self.assertEqual((runner.cache.hits, runner.cache.misses), (1, 2))
+        with self.assertRaises(TypeError):
+            ProcessingRunner(LRUCache())
+
+
+class DiskCacheTest(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_values(self):
+        cache = DiskCache(self.tmp_dir.name)
+        for value in [10, {'a': [1, 2]}, np.arange(12, dtype='f').reshape(3, 4), np.float64(2.5), {'x': np.ones(3)}]:
+            with self.subTest(value=value):
+                cache.put('key', value)
+                found, restored = cache.get('key')
+                self.assertTrue(found)
+                np.testing.assert_equal(restored, value)
+        self.assertEqual(cache.get('other'), (False, None))
+
+    def test_persistence(self):
+        calls.clear()
+        for _ in range(2):
+            # a new cache object each time, as after a restart of the process
+            master = TaskMaster(SimpleRunner(DiskCache(self.tmp_dir.name)))
+            self.assertEqual(master.execute({}, counted_product).data, 20)
+        self.assertEqual(len(calls), 1)
+
+    def test_content_key(self):
+        node = TaskNode(counted_product)
+        self.assertEqual(content_key({}, node), content_key({}, TaskNode(counted_product)))
+        # metadata of a dependency changes the key of the dependent task
+        self.assertNotEqual(content_key({}, node), content_key({'counted_scale': {'x': 1}}, node))
+
+    def test_content_key_in_other_process(self):
+        # the key must not depend on addresses of objects or on hash randomization
+        code = 'from stem.task_cache import content_key; from stem.task_tree import TaskNode; ' \
+               'from tests.test_task_cache import nested_code; print(content_key({}, TaskNode(nested_code)))'
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        keys = [
+            subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True).stdout
+            for _ in range(2)
+        ]
+        self.assertEqual(keys[0], keys[1])
+
+    def test_content_key_of_code(self):
+        node = TaskNode(counted_product)
+        changed = task(lambda meta, counted_scale: 3 * counted_scale)
+        changed._name = 'counted_product'
+        changed.dependencies = counted_product.dependencies
+        changed.__module__ = counted_product.__module__
+        self.assertNotEqual(content_key({}, node), content_key({}, TaskNode(changed)))
+
+        self.assertNotEqual(content_key({}, TaskNode(MapTask(lambda x: x + 1, counted_scale))),
+                            content_key({}, TaskNode(MapTask(lambda x: x + 2, counted_scale))))
+
+    def test_content_key_is_memoized(self):
+        from tests.test_task_runner import diamond_top
+        node = TaskNode(diamond_top)
+        with mock.patch.object(task_cache, '_task_fingerprint', wraps=task_cache._task_fingerprint) as fingerprint:
+            content_key({}, node)
+        self.assertEqual(fingerprint.call_count, 20)  # once per node, not per path
+
+    def test_corrupt_file(self):
+        cache = DiskCache(self.tmp_dir.name)
+        cache.put('key', {'a': 1})
+        path = cache._path('key')
+        path.write_bytes(path.read_bytes()[:-3])
+        self.assertEqual(cache.get('key'), (False, None))
+        path.write_bytes(b'')
+        self.assertEqual(cache.get('key'), (False, None))
+
+    def test_unpicklable(self):
+        cache = DiskCache(self.tmp_dir.name)
+        cache.put('key', Lock())
+        self.assertEqual(cache.get('key'), (False, None))
+        self.assertEqual(os.listdir(cache._path('key').parent), [])
+
+    def test_tiered(self):
+        memory, disk = LRUCache(), DiskCache(self.tmp_dir.name)
+        disk.store({}, TaskNode(data_scale), 10)
+        cache = TieredCache(memory, disk)
+        self.assertEqual(cache.lookup({}, TaskNode(data_scale)), (True, 10))
+        self.assertEqual(len(memory), 1)
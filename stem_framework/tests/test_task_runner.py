@@ -1,11 +1,21 @@
-from unittest import TestCase
+import asyncio
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Barrier, Event, Thread
+from unittest import TestCase, skipUnless
 
-from stem.task import FunctionDataTask, data, task
+import numpy as np
+
+from stem.meta import get_meta_attr
+from stem.task import FunctionDataTask, FunctionTask, MapTask, ReduceTask, data, task
 from stem.task_master import TaskMaster
-from stem.task_runner import SimpleRunner, TaskRunner, ThreadingRunner, AsyncRunner, ProcessingRunner
+from stem.task_runner import SimpleRunner, TaskRunner, ThreadingRunner, AsyncRunner, ProcessingRunner, StreamingRunner, TaskReference
+from stem.task_tree import TaskNode
 from stem.workspace import Workspace
 
-from tests.example_task import int_scale
+from tests.example_task import int_scale, float_reduce
+from tests.example_workspace import SubWorkspace
 
 
 class RunnerTest(TestCase):
@@ -16,17 +26,127 @@ class RunnerTest(TestCase):
         for i, r in zip(range(0, 100, 10), result.data):
             self.assertEqual(i, r)
 
+    def _run_diamond(self, runner: TaskRunner):
+        # every level doubles the number of paths to diamond_0
+        diamond_calls.clear()
+        result = TaskMaster(runner).execute({}, diamond_top)
+        self.assertEqual(result.data, 2**9)
+        self.assertEqual(len(diamond_calls), 1)
+
     def test_simple(self):
         runner = SimpleRunner()
         self._run(runner)
+        self._run_diamond(runner)
 
     def test_threading(self):
         runner = ThreadingRunner(5)
         self._run(runner)
+        self._run_diamond(runner)
 
     def test_async(self):
         runner = AsyncRunner()
         self._run(runner)
+        self._run_diamond(runner)
+
+    def test_async_tasks(self):
+        for runner in [SimpleRunner(), ThreadingRunner(2), AsyncRunner()]:
+            with self.subTest(runner=runner):
+                self.assertEqual(TaskMaster(runner).execute({}, async_sum).data, 3)
+
+    def test_async_task_inside_event_loop(self):
+        async def main():
+            return TaskMaster(SimpleRunner()).execute({}, async_sum).data
+
+        with self.assertRaisesRegex(RuntimeError, 'AsyncRunner'):
+            asyncio.run(main())
+
+    def test_async_runner_offloads_sync_tasks(self):
+        # the sync task blocks until the async one runs,
+        # which is possible only if the sync task does not block the event loop
+        loop_is_free.clear()
+        result = TaskMaster(AsyncRunner()).execute({}, async_and_blocking)
+        self.assertEqual(result.data, (True, True))
+
+    def test_async_runner_process_executor(self):
+        with ProcessPoolExecutor(2) as executor:
+            result = TaskMaster(AsyncRunner(executor=executor)).execute({}, int_scale)
+            self.assertEqual(list(result.data), list(range(0, 100, 10)))
+
+    def _with_timeout(self, test, timeout=60):
+        # a deadlock of the streams must fail the test instead of hanging the suite
+        errors = []
+
+        def target():
+            try:
+                test()
+            except BaseException as e:
+                errors.append(e)
+
+        thread = Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), 'the run has not finished in time')
+        if errors:
+            raise errors[0]
+
+    def test_streaming(self):
+        self._with_timeout(lambda: self._run(StreamingRunner(chunk_size=3)))
+        self._with_timeout(lambda: self._run_diamond(StreamingRunner()))
+
+        def long_run():
+            stream_log.update(produced=0, consumed=0, max_lag=0)
+            runner = StreamingRunner(chunk_size=100, max_chunks=2)
+            result = TaskMaster(runner).execute({}, long_reduce)
+            self.assertEqual(result.data, 2 * sum(range(100_000)))
+            # the source is never far ahead of the consumer:
+            # chunks in the two queues + a chunk in each stage
+            self.assertLessEqual(stream_log['max_lag'], 100 * (2 + 2) * 2 + 1)
+
+        self._with_timeout(long_run)
+
+    def test_streaming_reconverging(self):
+        # long_range is read by both stream_pairs and long_doubled,
+        # stream_pairs reads all of long_range before long_doubled,
+        # bounded streams would deadlock
+        def run():
+            stop = {'stop': 1000}
+            meta = {'long_range': stop, 'long_doubled': {'long_range': stop}}
+            result = TaskMaster(StreamingRunner(chunk_size=10, max_chunks=1)).execute(meta, stream_pairs)
+            self.assertEqual(result.data, 3 * sum(range(1000)))
+
+        self._with_timeout(run)
+
+    def test_streaming_error(self):
+        def run():
+            result = TaskMaster(StreamingRunner()).execute({}, failing_sum)
+            with self.assertRaises(ValueError):
+                result.data
+
+        self._with_timeout(run)
+
+    def test_streaming_max_workers(self):
+        result = TaskMaster(StreamingRunner(max_workers=2)).execute({}, long_reduce)
+        with self.assertRaises(ValueError):
+            result.data
+
+    def test_parallel_reduce_on_runner_pool(self):
+        # the reduction waits for its chunks on the pool it runs on,
+        # it must not deadlock even with a single worker
+        for runner in [ThreadingRunner(1), ThreadingRunner(4), SimpleRunner()]:
+            with self.subTest(runner=runner):
+                result = TaskMaster(runner).execute({'map_long_range': {'long_range': {'stop': 10_000}}}, parallel_sum)
+                self.assertEqual(result.data, 2 * sum(range(10_000)))
+
+    def test_siblings_run_concurrently(self):
+        # each branch waits for the other one at the barrier,
+        # so the run finishes only if both branches are submitted at once
+        barrier.reset()
+        result = TaskMaster(ThreadingRunner(2)).execute({}, wide_top)
+        self.assertEqual(result.data, 2)
+
+    def test_shared_iterator(self):
+        result = TaskMaster(ThreadingRunner(2)).execute({}, consume_both)
+        self.assertEqual(result.data, 2 * sum(range(10)))
 
 
     def test_process(self):
@@ -42,6 +162,38 @@ class RunnerTest(TestCase):
         for i, r in zip(range(0, 100, 10), result.data):
             self.assertEqual(i, r)
 
+    def test_process_decorated_tasks(self):
+        # tasks of example_task use lambdas and return generators and map objects
+        result = TaskMaster(ProcessingRunner(2)).execute({}, float_reduce)
+        expected = TaskMaster(SimpleRunner()).execute({}, float_reduce)
+        self.assertAlmostEqual(result.data, expected.data, places=3)
+
+        result = TaskMaster(ProcessingRunner(2)).execute({}, int_scale)
+        self.assertEqual(result.data, list(range(0, 100, 10)))
+
+    @skipUnless(os.path.isdir('/dev/shm'), 'POSIX shared memory is listed in /dev/shm')
+    def test_process_shared_memory(self):
+        segments_before = set(os.listdir('/dev/shm'))
+
+        total, is_shared = TaskMaster(ProcessingRunner(2)).execute({}, big_report).data
+        self.assertEqual(total, 2 * sum(range(1_000_000)))
+        self.assertTrue(is_shared)
+
+        result = TaskMaster(ProcessingRunner(2)).execute({}, big_double).data
+        np.testing.assert_array_equal(result, 2 * np.arange(1_000_000))
+
+        # all segments are unlinked
+        self.assertSetEqual(set(os.listdir('/dev/shm')) - segments_before, set())
+
+    def test_task_reference(self):
+        reference = TaskReference.of(TaskNode(SubWorkspace.int_reduce))
+        self.assertIsNotNone(reference)
+        self.assertIs(reference.resolve(), SubWorkspace.int_reduce)
+
+        unregistered = FunctionTask('unregistered', lambda meta: 1, ())
+        self.assertIsNone(TaskReference.of(TaskNode(unregistered)))
+        self.assertEqual(TaskMaster(ProcessingRunner(2)).execute({}, unregistered).data, 1)
+
 
 
 # Picklable Workspace
@@ -61,4 +213,162 @@ int_range = FunctionDataTask('int_range', int_range_func)
 def data_scale_func(meta):
     return 10
 
-data_scale = FunctionDataTask('data_scale', data_scale_func)
\ No newline at end of file
+data_scale = FunctionDataTask('data_scale', data_scale_func)
+
+
+# Diamond-shaped pipeline:
+# level_n_a and level_n_b both depend on level_{n-1}_a and level_{n-1}_b
+
+diamond_calls = []
+
+@data
+def diamond_base(meta) -> int:
+    diamond_calls.append(meta)
+    return 1
+
+def _diamond_level(name, left, right):
+    return FunctionTask(name, lambda meta, **kwargs: sum(kwargs.values()), (left, right))
+
+_left = _right = diamond_base
+for _n in range(1, 11):
+    _left, _right = (
+        _diamond_level(f'level_{_n}_a', _left, _right),
+        _diamond_level(f'level_{_n}_b', _left, _right)
+    )
+diamond_top = _left
+
+
+@data
+def shared_range(meta):
+    return iter(range(10))
+
+@task
+def consume_a(meta, shared_range):
+    return sum(shared_range)
+
+@task
+def consume_b(meta, shared_range):
+    return sum(shared_range)
+
+@task
+def consume_both(meta, consume_a, consume_b):
+    return consume_a + consume_b
+
+
+# Wide tree: two independent branches
+
+barrier = Barrier(2, timeout=5)
+
+@data
+def wide_leaf_a(meta):
+    barrier.wait()
+    return 1
+
+@data
+def wide_leaf_b(meta):
+    barrier.wait()
+    return 1
+
+@task
+def wide_branch_a(meta, wide_leaf_a):
+    return wide_leaf_a
+
+@task
+def wide_branch_b(meta, wide_leaf_b):
+    return wide_leaf_b
+
+@task
+def wide_top(meta, wide_branch_a, wide_branch_b):
+    return wide_branch_a + wide_branch_b
+
+
+# Large arrays
+
+@data
+def big_range(meta):
+    return np.arange(1_000_000, dtype='f8')
+
+@task
+def big_double(meta, big_range):
+    return 2 * big_range
+
+@task
+def big_is_shared(meta, big_range):
+    # a view of shared memory, not an unpickled copy
+    return isinstance(big_range.base, mmap.mmap)
+
+@task
+def big_report(meta, big_double, big_is_shared):
+    return float(big_double.sum()), big_is_shared
+
+
+
+# Async tasks
+
+@data
+async def async_one(meta):
+    await asyncio.sleep(0)
+    return 1
+
+@task
+async def async_two(meta, async_one):
+    await asyncio.sleep(0)
+    return 2 * async_one
+
+@task
+def async_sum(meta, async_one, async_two):
+    return async_one + async_two
+
+
+loop_is_free = Event()
+
+@data
+async def sets_event(meta):
+    await asyncio.sleep(0.01)
+    loop_is_free.set()
+    return True
+
+@data
+def blocking(meta):
+    return loop_is_free.wait(timeout=5)
+
+@task
+def async_and_blocking(meta, sets_event, blocking):
+    return sets_event, blocking
+
+
+# Streaming pipeline
+
+stream_log = {'produced': 0, 'consumed': 0, 'max_lag': 0}
+
+@data
+def long_range(meta):
+    for i in range(get_meta_attr(meta, 'stop', 100_000)):
+        stream_log['produced'] += 1
+        yield i
+
+long_scale = MapTask(lambda x: 2 * x, long_range)
+
+def _count_and_add(acc, x):
+    stream_log['consumed'] += 1
+    stream_log['max_lag'] = max(stream_log['max_lag'], stream_log['produced'] - stream_log['consumed'])
+    return acc + x
+
+long_reduce = ReduceTask(_count_and_add, long_scale)
+
+parallel_sum = ReduceTask(np.add, long_scale, chunk_size=100, parallel=True)
+
+@data
+def failing_range(meta):
+    yield 1
+    raise ValueError('broken source')
+
+failing_sum = ReduceTask(lambda acc, x: acc + x, MapTask(lambda x: x, failing_range))
+
+@task
+def long_doubled(meta, long_range):
+    return (2 * x for x in long_range)
+
+@task
+def stream_pairs(meta, long_range, long_doubled):
+    return sum(long_range) + sum(long_doubled)
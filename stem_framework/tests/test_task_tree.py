@@ -1,6 +1,7 @@
 from unittest import TestCase
 
 
+from stem.task import data, task
 from stem.task_tree import TaskTree
 from tests.example_task import int_range, int_scale
 
@@ -11,3 +12,26 @@ class TaskTreeTest(TestCase):
 
     def test_task_tree(self):
         self.assertEqual(self.task_node.dependencies[0].task, int_range)
+
+    def test_shared_node(self):
+        node = TaskTree.build_node(diamond_top)
+        left, right = node.dependencies
+        self.assertIs(left.dependencies[0], right.dependencies[0])
+        self.assertIs(node.find_node(diamond_base), left.dependencies[0])
+
+
+@data
+def diamond_base(meta) -> int:
+    return 1
+
+@task
+def diamond_left(meta, diamond_base):
+    return diamond_base
+
+@task
+def diamond_right(meta, diamond_base):
+    return diamond_base
+
+@task
+def diamond_top(meta, diamond_left, diamond_right):
+    return diamond_left + diamond_right